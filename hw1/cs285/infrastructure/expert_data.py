@@ -0,0 +1,95 @@
+import os
+import pickle
+
+import numpy as np
+
+# the per-transition fields of a rollout, each stored as one column
+FIELDS = ('observation', 'action', 'reward', 'next_observation', 'terminal')
+
+
+class ExpertData(object):
+    """
+        Expert rollouts in the columnar format written by convert_expert_data:
+        one .npy file per field, holding that field of all the rollouts back to
+        back, and path_offsets.npy, where rollout i spans
+        path_offsets[i]:path_offsets[i + 1].
+
+        The columns are memory-mapped on first use, so nothing is read before
+        it is needed. Indexing and iterating give the rollouts as Path
+        dictionaries of views, so this can stand in for the list of paths
+        loaded from an expert_data_*.pkl file.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.path_offsets = np.load(os.path.join(data_dir, 'path_offsets.npy'))
+        self._columns = {}
+
+    def column(self, field):
+        """
+            The given field of all the rollouts, as a read-only memmap
+        """
+        if field not in self._columns:
+            self._columns[field] = np.load(
+                os.path.join(self.data_dir, field + '.npy'), mmap_mode='r')
+        return self._columns[field]
+
+    @property
+    def path_lengths(self):
+        return np.diff(self.path_offsets)
+
+    @property
+    def num_transitions(self):
+        return int(self.path_offsets[-1])
+
+    def __len__(self):
+        return len(self.path_offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        start, end = self.path_offsets[i], self.path_offsets[i + 1]
+        path = {field: self.column(field)[start:end] for field in FIELDS}
+        path['image_obs'] = np.array([], dtype=np.uint8)
+        return path
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def convert_expert_data(pkl_path, data_dir):
+    """
+        Write the rollouts of an expert_data_*.pkl file to data_dir in the
+        columnar format read by ExpertData
+    """
+    with open(pkl_path, 'rb') as f:
+        paths = pickle.load(f)
+
+    lengths = [len(path['reward']) for path in paths]
+    path_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    os.makedirs(data_dir, exist_ok=True)
+    for field in FIELDS:
+        first = np.asarray(paths[0][field])
+        column = np.lib.format.open_memmap(
+            os.path.join(data_dir, field + '.npy'), mode='w+', dtype=first.dtype,
+            shape=(path_offsets[-1],) + first.shape[1:])
+        # copy one rollout at a time, instead of concatenating them all in memory
+        for path, start, end in zip(paths, path_offsets[:-1], path_offsets[1:]):
+            column[start:end] = path[field]
+        column.flush()
+        del column
+    # written last, so that a directory with an index is complete
+    np.save(os.path.join(data_dir, 'path_offsets.npy'), path_offsets)
+
+
+def load_expert_data(path):
+    """
+        The expert rollouts at path: an ExpertData if path is a directory
+        written by convert_expert_data, the unpickled list of paths otherwise
+    """
+    if os.path.isdir(path):
+        return ExpertData(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,201 @@
+import copy
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import gym
+import numpy as np
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+from cs285.infrastructure.utils import Path
+
+# fields written by the workers, in the order Path expects them
+PATH_FIELDS = ['observation', 'action', 'reward', 'next_observation', 'terminal']
+
+# seconds to wait for a worker to exit before terminating it
+CLOSE_TIMEOUT = 10
+
+
+class ParallelSampler(object):
+    """
+        Collects rollouts with K worker processes, each stepping its own env
+        (built from params['env_name'] and params['env_kwargs']) with its own
+        copy of the policy.
+
+        The policy weights are pushed to the workers at the start of every call
+        to sample_trajectories. Transitions come back through shared-memory
+        arrays; only the episode lengths go through the pipes. With
+        params['numpy_inference'], the workers act with a NumPy copy of the
+        policy.
+    """
+
+    def __init__(self, params, policy, num_workers):
+        self.num_workers = num_workers
+
+        env = gym.make(params['env_name'], **params['env_kwargs'])
+        ob_shape = env.observation_space.shape
+        ac_shape = env.action_space.shape
+        env.close()
+
+        # every worker gets room for its share of the largest batch we ask
+        # for, plus one episode of overshoot
+        max_batch_size = max(params['batch_size'], params['eval_batch_size'])
+        self.capacity = (int(np.ceil(max_batch_size / num_workers))
+                         + params['ep_len'])
+
+        # one (num_workers, capacity, ...) array per field, where each worker
+        # only ever writes to its own row
+        field_shapes = {
+            'observation': ob_shape,
+            'action': ac_shape,
+            'reward': (),
+            'next_observation': ob_shape,
+            'terminal': (),
+        }
+        self.shms = {}
+        self.arrays = {}
+        shm_specs = {}
+        for name, shape in field_shapes.items():
+            full_shape = (num_workers, self.capacity) + tuple(shape)
+            nbytes = int(np.prod(full_shape)) * np.dtype(np.float32).itemsize
+            shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+            self.shms[name] = shm
+            self.arrays[name] = np.ndarray(
+                full_shape, dtype=np.float32, buffer=shm.buf)
+            shm_specs[name] = (shm.name, full_shape)
+
+        # the workers run on CPU, whatever device the learner is on
+        worker_policy = copy.deepcopy(policy).to('cpu')
+
+        ctx = mp.get_context('spawn')
+        self.remotes = []
+        self.processes = []
+        for worker_id in range(num_workers):
+            remote, worker_remote = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker,
+                args=(worker_remote, worker_id, params['env_name'],
+                      params['env_kwargs'], params['seed'] + worker_id + 1,
+                      worker_policy, params['numpy_inference'], shm_specs),
+                daemon=True,
+            )
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+    def sample_trajectories(self, policy, min_timesteps_per_batch, max_path_length):
+        """
+            Collect rollouts until we have collected min_timesteps_per_batch
+            steps, split evenly over the workers.
+        """
+        steps_per_worker = int(np.ceil(min_timesteps_per_batch / self.num_workers))
+        assert steps_per_worker + max_path_length <= self.capacity, (
+            'ParallelSampler was sized for smaller batches')
+
+        state_dict = {k: v.cpu().numpy() for k, v in policy.state_dict().items()}
+        for remote in self.remotes:
+            remote.send(('sample', (state_dict, steps_per_worker, max_path_length)))
+
+        paths = []
+        timesteps_this_batch = 0
+        for worker_id, remote in enumerate(self.remotes):
+            path_lengths = remote.recv()
+            start = 0
+            for length in path_lengths:
+                end = start + length
+                obs, acs, rewards, next_obs, terminals = [
+                    self.arrays[name][worker_id, start:end] for name in PATH_FIELDS]
+                # Path copies out of the shared arrays, which get reused
+                paths.append(Path(obs, [], acs, rewards, next_obs, terminals))
+                start = end
+            timesteps_this_batch += start
+
+        return paths, timesteps_this_batch
+
+    def close(self):
+        """
+            Stop the workers and free the shared memory. Also called when
+            training stops with an error, so the workers may already be gone
+            or still busy with a sample request.
+        """
+        try:
+            for remote in self.remotes:
+                try:
+                    remote.send(('close', None))
+                except (BrokenPipeError, OSError):
+                    pass
+            for process in self.processes:
+                process.join(timeout=CLOSE_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        finally:
+            # the segments outlive the processes unless unlinked
+            for shm in self.shms.values():
+                shm.close()
+                shm.unlink()
+
+
+def _worker(remote, worker_id, env_name, env_kwargs, seed, policy, numpy_inference, shm_specs):
+    ptu.device = torch.device('cpu')
+    torch.set_num_threads(1)
+
+    env = gym.make(env_name, **env_kwargs)
+    env.reset(seed=seed)
+
+    shms = {}
+    arrays = {}
+    for name, (shm_name, full_shape) in shm_specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        shms[name] = shm
+        arrays[name] = np.ndarray(
+            full_shape, dtype=np.float32, buffer=shm.buf)[worker_id]
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'sample':
+                state_dict, num_steps, max_path_length = data
+                policy.load_state_dict(
+                    {k: torch.from_numpy(v) for k, v in state_dict.items()})
+                rollout_policy = policy.to_numpy_policy() if numpy_inference else policy
+                with torch.no_grad():
+                    path_lengths = _collect(
+                        env, rollout_policy, arrays, num_steps, max_path_length)
+                remote.send(path_lengths)
+            elif cmd == 'close':
+                break
+    finally:
+        env.close()
+        for shm in shms.values():
+            shm.close()
+
+
+def _collect(env, policy, arrays, num_steps, max_path_length):
+    """
+        Run full episodes until num_steps steps are written into arrays,
+        and return the length of each episode.
+    """
+    steps = 0
+    path_lengths = []
+    while steps < num_steps:
+        ob = env.reset()
+        path_start = steps
+        while True:
+            ac = policy.get_action(ob)[0]
+            next_ob, rew, done, _ = env.step(ac)
+
+            rollout_done = (done or steps + 1 - path_start >= max_path_length)
+            arrays['observation'][steps] = ob
+            arrays['action'][steps] = ac
+            arrays['reward'][steps] = rew
+            arrays['next_observation'][steps] = next_ob
+            arrays['terminal'][steps] = rollout_done
+            steps += 1
+
+            ob = next_ob
+            if rollout_done:
+                break
+        path_lengths.append(steps - path_start)
+    return path_lengths
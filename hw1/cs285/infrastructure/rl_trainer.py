@@ -2,7 +2,7 @@ from collections import OrderedDict
 from sys import implementation
 import numpy as np
 import time
-import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 import gym
 from gym import Env
@@ -11,6 +11,9 @@ import torch
 from cs285.infrastructure import pytorch_util as ptu
 from cs285.infrastructure.logger import Logger
 from cs285.infrastructure import utils
+from cs285.infrastructure.expert_data import load_expert_data
+from cs285.infrastructure.parallel_sampler import ParallelSampler
+from cs285.infrastructure.async_evaluator import AsyncEvaluator
 
 # how many rollouts to save as videos to tensorboard
 MAX_NVIDEO = 2
@@ -49,6 +52,18 @@ class RL_Trainer(object):
             self.params['env_name'], **self.params['env_kwargs'])
         self.env.reset(seed=seed)
 
+        # Extra copies of the env, stepped in lockstep with self.env so that
+        # the policy is queried once per tick when collecting rollouts
+        if self.params['num_envs'] > 1:
+            self.rollout_env = [self.env]
+            for i in range(1, self.params['num_envs']):
+                env = gym.make(
+                    self.params['env_name'], **self.params['env_kwargs'])
+                env.reset(seed=seed + i)
+                self.rollout_env.append(env)
+        else:
+            self.rollout_env = self.env
+
         # Maximum length for episodes
         self.params['ep_len'] = self.params['ep_len'] or self.env.spec.max_episode_steps
         MAX_VIDEO_LEN = self.params['ep_len']
@@ -93,57 +108,81 @@ class RL_Trainer(object):
         self.total_envsteps = 0
         self.start_time = time.time()
 
+        # worker processes that collect rollouts in parallel
+        if self.params['num_workers'] > 0:
+            self.sampler = ParallelSampler(
+                self.params, collect_policy, self.params['num_workers'])
+        else:
+            self.sampler = None
+
+        # background process that runs the eval rollouts while we keep training
+        if self.params['async_eval']:
+            self.evaluator = AsyncEvaluator(self.params, eval_policy)
+        else:
+            self.evaluator = None
+
         """
         First train on all data, then relable
         """
-        for itr in range(n_iter):
-            print("\n\n********** Iteration %i ************" % itr)
-
-            # decide if videos should be rendered/logged at this iteration
-            if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
-                self.log_video = True
-            else:
-                self.log_video = False
-
-            # decide if metrics should be logged
-            if itr % self.params['scalar_log_freq'] == 0:
-                self.log_metrics = True
-            else:
-                self.log_metrics = False
-
-            # collect trajectories, to be used for training
-            training_returns = self.collect_training_trajectories(
-                itr,
-                initial_expertdata,
-                collect_policy,
-                self.params['batch_size']
-            )  # HW1: implement this function below
-            paths, envsteps_this_batch, train_video_paths = training_returns
-            self.total_envsteps += envsteps_this_batch
-
-            # relabel the collected obs with actions from a provided expert policy
-            if relabel_with_expert and itr >= start_relabel_with_expert:
-                # HW1: implement this function below
-                paths = self.do_relabel_with_expert(expert_policy, paths)
-
-            # add collected data to replay buffer
-            self.agent.add_to_replay_buffer(paths)
-
-            # train agent (using sampled data from replay buffer)
-            training_logs = self.train_agent()  # HW1: implement this function below
-
-            # log/save
-            if self.log_video or self.log_metrics:
-
-                # perform logging
-                print('\nBeginning logging procedure...')
-                self.perform_logging(
-                    itr, paths, eval_policy, train_video_paths, training_logs)
-
-                if self.params['save_params']:
-                    print('\nSaving agent params')
-                    self.agent.save(
-                        '{}/policy_itr_{}.pt'.format(self.params['logdir'], itr))
+        # the workers and their shared memory are freed whichever way
+        # training stops
+        try:
+            for itr in range(n_iter):
+                print("\n\n********** Iteration %i ************" % itr)
+
+                # decide if videos should be rendered/logged at this iteration
+                if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
+                    self.log_video = True
+                else:
+                    self.log_video = False
+
+                # decide if metrics should be logged
+                if itr % self.params['scalar_log_freq'] == 0:
+                    self.log_metrics = True
+                else:
+                    self.log_metrics = False
+
+                # collect trajectories, to be used for training
+                training_returns = self.collect_training_trajectories(
+                    itr,
+                    initial_expertdata,
+                    collect_policy,
+                    self.params['batch_size']
+                )  # HW1: implement this function below
+                paths, envsteps_this_batch, train_video_paths = training_returns
+                self.total_envsteps += envsteps_this_batch
+
+                # relabel the collected obs with actions from a provided expert policy
+                if relabel_with_expert and itr >= start_relabel_with_expert:
+                    # HW1: implement this function below
+                    paths = self.do_relabel_with_expert(expert_policy, paths)
+
+                # add collected data to replay buffer
+                self.agent.add_to_replay_buffer(paths)
+
+                # train agent (using sampled data from replay buffer)
+                training_logs = self.train_agent()  # HW1: implement this function below
+
+                # log/save
+                if self.log_video or self.log_metrics:
+
+                    # perform logging
+                    print('\nBeginning logging procedure...')
+                    self.perform_logging(
+                        itr, paths, eval_policy, train_video_paths, training_logs)
+
+                    if self.params['save_params']:
+                        print('\nSaving agent params')
+                        self.agent.save(
+                            '{}/policy_itr_{}.pt'.format(self.params['logdir'], itr))
+
+            if self.evaluator is not None:
+                self.log_async_eval(self.evaluator.poll(block=True))
+        finally:
+            if self.sampler is not None:
+                self.sampler.close()
+            if self.evaluator is not None:
+                self.evaluator.close()
 
     ####################################
     ####################################
@@ -157,7 +196,8 @@ class RL_Trainer(object):
     ):
         """
         :param itr:
-        :param load_initial_expertdata:  path to expert data pkl file
+        :param load_initial_expertdata:  path to expert data pkl file, or to a
+            directory of expert data converted by scripts/convert_expert_data.py
         :param collect_policy:  the current policy using which we collect data
         :param batch_size:  the number of transitions we collect
         :return:
@@ -173,14 +213,19 @@ class RL_Trainer(object):
 
         # (2) collect `self.params['batch_size']` transitions
         if itr < 1:
-            return pickle.load(open(load_initial_expertdata, "rb")), 0, None
+            return load_expert_data(load_initial_expertdata), 0, None
 
         # TODO collect `batch_size` samples to be used for training
         # HINT1: use sample_trajectories from utils
         # HINT2: you want each of these collected rollouts to be of length self.params['ep_len']
         print("\nCollecting data to be used for training...")
-        paths, envsteps_this_batch = utils.sample_trajectories(
-            self.env, collect_policy, self.params['batch_size'], self.params['ep_len'])
+        if self.sampler is not None:
+            paths, envsteps_this_batch = self.sampler.sample_trajectories(
+                collect_policy, self.params['batch_size'], self.params['ep_len'])
+        else:
+            paths, envsteps_this_batch = utils.sample_trajectories(
+                self.rollout_env, self.rollout_policy(collect_policy),
+                self.params['batch_size'], self.params['ep_len'])
 
         # collect more rollouts with the same policy, to be saved as videos in tensorboard
         # note: here, we collect MAX_NVIDEO rollouts, each of length MAX_VIDEO_LEN
@@ -189,10 +234,19 @@ class RL_Trainer(object):
             print('\nCollecting train rollouts to be used for saving videos...')
             # TODO look in utils and implement sample_n_trajectories
             train_video_paths = utils.sample_n_trajectories(
-                self.env, collect_policy, MAX_NVIDEO, MAX_VIDEO_LEN, True)
+                self.env, self.rollout_policy(collect_policy), MAX_NVIDEO, MAX_VIDEO_LEN, True)
 
         return paths, envsteps_this_batch, train_video_paths
 
+    def rollout_policy(self, policy):
+        """
+            The policy to collect rollouts with: a NumPy copy of policy if
+            params['numpy_inference'] is set, policy itself otherwise
+        """
+        if self.params['numpy_inference']:
+            return policy.to_numpy_policy()
+        return policy
+
     def train_agent(self):
         print('\nTraining agent using sampled data from replay buffer...')
         all_logs = []
@@ -218,9 +272,23 @@ class RL_Trainer(object):
         # TODO: relabel collected obsevations (from our policy) with labels from an expert policy
         # HINT: query the policy (using the get_action function) with paths[i]["observation"]
         # and replace paths[i]["action"] with these expert labels
-        for i in range(len(paths)):
-            expert_label = expert_policy.get_action(paths[i]["observation"])
-            paths[i]["action"] = expert_label
+
+        # query the expert on the observations of all the paths at once, in
+        # chunks of relabel_chunk_size, and split the labels back up by path
+        observations = np.concatenate([path["observation"] for path in paths])
+        path_offsets = np.cumsum([utils.get_pathlength(path) for path in paths])[:-1]
+        chunk_size = self.params['relabel_chunk_size']
+        chunks = [observations[start:start + chunk_size]
+                  for start in range(0, len(observations), chunk_size)]
+        if self.params['relabel_num_workers'] > 0 and len(chunks) > 1:
+            with ThreadPoolExecutor(self.params['relabel_num_workers']) as pool:
+                expert_labels = list(pool.map(expert_policy.get_action, chunks))
+        else:
+            expert_labels = [expert_policy.get_action(chunk) for chunk in chunks]
+        expert_labels = np.concatenate(expert_labels)
+
+        for path, expert_label in zip(paths, np.split(expert_labels, path_offsets)):
+            path["action"] = expert_label
         return paths
 
     ####################################
@@ -229,15 +297,26 @@ class RL_Trainer(object):
     def perform_logging(self, itr, paths, eval_policy, train_video_paths, training_logs):
 
         # collect eval trajectories, for logging
-        print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(
-            self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        if self.evaluator is not None:
+            # the Eval_* metrics get logged under this itr once they are done
+            if self.log_metrics:
+                print("\nSubmitting policy for async eval...")
+                self.evaluator.submit(itr, eval_policy)
+        else:
+            print("\nCollecting data for eval...")
+            if self.sampler is not None:
+                eval_paths, eval_envsteps_this_batch = self.sampler.sample_trajectories(
+                    eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+            else:
+                eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(
+                    self.rollout_env, self.rollout_policy(eval_policy),
+                    self.params['eval_batch_size'], self.params['ep_len'])
 
         # save eval rollouts as videos in tensorboard event file
         if self.log_video and train_video_paths != None:
             print('\nCollecting video rollouts eval')
             eval_video_paths = utils.sample_n_trajectories(
-                self.env, eval_policy, MAX_NVIDEO, MAX_VIDEO_LEN, True)
+                self.env, self.rollout_policy(eval_policy), MAX_NVIDEO, MAX_VIDEO_LEN, True)
 
             # save train/eval videos
             print('\nSaving train rollouts as videos...')
@@ -250,21 +329,23 @@ class RL_Trainer(object):
         if self.log_metrics:
             # returns, for logging
             train_returns = [path["reward"].sum() for path in paths]
-            eval_returns = [eval_path["reward"].sum()
-                            for eval_path in eval_paths]
 
             # episode lengths, for logging
             train_ep_lens = [len(path["reward"]) for path in paths]
-            eval_ep_lens = [len(eval_path["reward"])
-                            for eval_path in eval_paths]
 
             # decide what to log
             logs = OrderedDict()
-            logs["Eval_AverageReturn"] = np.mean(eval_returns)
-            logs["Eval_StdReturn"] = np.std(eval_returns)
-            logs["Eval_MaxReturn"] = np.max(eval_returns)
-            logs["Eval_MinReturn"] = np.min(eval_returns)
-            logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
+            if self.evaluator is None:
+                eval_returns = [eval_path["reward"].sum()
+                                for eval_path in eval_paths]
+                eval_ep_lens = [len(eval_path["reward"])
+                                for eval_path in eval_paths]
+
+                logs["Eval_AverageReturn"] = np.mean(eval_returns)
+                logs["Eval_StdReturn"] = np.std(eval_returns)
+                logs["Eval_MaxReturn"] = np.max(eval_returns)
+                logs["Eval_MinReturn"] = np.min(eval_returns)
+                logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
 
             logs["Train_AverageReturn"] = np.mean(train_returns)
             logs["Train_StdReturn"] = np.std(train_returns)
@@ -288,3 +369,16 @@ class RL_Trainer(object):
             print('Done logging...\n\n')
 
             self.logger.flush()
+
+        # log whichever async evals have finished by now
+        if self.evaluator is not None:
+            self.log_async_eval(self.evaluator.poll())
+
+    def log_async_eval(self, results):
+        for itr, logs in results:
+            print('\nAsync eval results for iteration %i' % itr)
+            for key, value in logs.items():
+                print('{} : {}'.format(key, value))
+                self.logger.log_scalar(value, key, itr)
+        if results:
+            self.logger.flush()
@@ -18,54 +18,56 @@ def sample_trajectory(env: Env, policy: MLPPolicy, max_path_length, render=False
     ob = env.reset()  # HINT: should be the output of resetting the env
 
     # init vars
-    obs, acs, rewards, next_obs, terminals, image_obs = [], [], [], [], [], []
-    steps = 0
+    traj = TrajectoryBuilder(env, max_path_length)
     while True:
 
         # render image of the simulated env
         if render:
             if hasattr(env, 'sim'):
-                image_obs.append(env.sim.render(
+                traj.add_image(env.sim.render(
                     camera_name='track', height=500, width=500)[::-1])
             else:
-                image_obs.append(env.render())
+                traj.add_image(env.render())
 
         # use the most recent ob to decide what to do
-        obs.append(ob)
         # HINT: query the policy's get_action function
         ac = policy.get_action(ob)
         ac = ac[0]
-        acs.append(ac)
 
         # take that action and record results
-        ob, rew, done, _ = env.step(ac)
-
-        # record result of taking that action
-        steps += 1
-        next_obs.append(ob)
-        rewards.append(rew)
+        next_ob, rew, done, _ = env.step(ac)
 
         # TODO end the rollout if the rollout ended
         # HINT: rollout can end due to done, or due to max_path_length
         # Using logic from get path length
         # HINT: this is either 0 or 1
-        rollout_done = (done or len(rewards) >= max_path_length)
-        terminals.append(rollout_done)
+        rollout_done = (done or traj.steps + 1 >= max_path_length)
+
+        # record result of taking that action
+        traj.add(ob, ac, rew, next_ob, rollout_done)
+        ob = next_ob
 
         if rollout_done:
             break
 
-    return Path(obs, image_obs, acs, rewards, next_obs, terminals)
+    return traj.build()
 
 
 def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, render=False):
     """
         Collect rollouts until we have collected min_timesteps_per_batch steps.
 
+        If env is a list of envs, they are stepped in lockstep
+        (see sample_trajectories_vectorized).
+
         TODO implement this function
         Hint1: use sample_trajectory to get each path (i.e. rollout) that goes into paths
         Hint2: use get_pathlength to count the timesteps collected in each path
     """
+    if isinstance(env, list):
+        return sample_trajectories_vectorized(
+            env, policy, min_timesteps_per_batch, max_path_length)
+
     timesteps_this_batch = 0
     paths = []
     while timesteps_this_batch < min_timesteps_per_batch:
@@ -76,6 +78,50 @@ def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, r
     return paths, timesteps_this_batch
 
 
+def sample_trajectories_vectorized(envs, policy, min_timesteps_per_batch, max_path_length):
+    """
+        Collect rollouts from several copies of an env stepped in lockstep,
+        querying the policy once per tick for all of them.
+
+        Finished sub-episodes are turned into paths as soon as they end. Once
+        min_timesteps_per_batch steps have been taken, envs are no longer reset,
+        but the episodes still in flight are run to completion so that only
+        full rollouts are returned.
+    """
+    num_envs = len(envs)
+    obs = np.stack([env.reset() for env in envs])
+    rollouts = [TrajectoryBuilder(env, max_path_length) for env in envs]
+    active = np.ones(num_envs, dtype=bool)
+
+    timesteps_this_batch = 0
+    paths = []
+    while active.any():
+        env_ids = np.flatnonzero(active)
+
+        # one batched forward pass for every env that is still running
+        acs = policy.get_action(obs[env_ids])
+
+        for env_id, ac in zip(env_ids, acs):
+            ob, rew, done, _ = envs[env_id].step(ac)
+            timesteps_this_batch += 1
+
+            traj = rollouts[env_id]
+            rollout_done = (done or traj.steps + 1 >= max_path_length)
+            traj.add(obs[env_id], ac, rew, ob, rollout_done)
+
+            if rollout_done:
+                paths.append(traj.build())
+                if timesteps_this_batch < min_timesteps_per_batch:
+                    ob = envs[env_id].reset()
+                    rollouts[env_id] = TrajectoryBuilder(envs[env_id], max_path_length)
+                else:
+                    active[env_id] = False
+
+            obs[env_id] = ob
+
+    return paths, timesteps_this_batch
+
+
 def sample_n_trajectories(env, policy, ntraj, max_path_length, render=False):
     """
         Collect ntraj rollouts.
@@ -110,6 +156,52 @@ def Path(obs, image_obs, acs, rewards, next_obs, terminals):
             "terminal": np.array(terminals, dtype=np.float32)}
 
 
+class TrajectoryBuilder(object):
+    """
+        Preallocates the arrays of a single rollout, sized from the env spaces
+        and the maximum number of steps, and writes each step into them in place.
+
+        build() returns the same dictionary as Path, with views trimmed to the
+        length of the rollout.
+    """
+
+    def __init__(self, env, max_path_length):
+        ob_shape = env.observation_space.shape
+        ac_shape = env.action_space.shape
+        self.obs = np.empty((max_path_length,) + ob_shape, dtype=np.float32)
+        self.acs = np.empty((max_path_length,) + ac_shape, dtype=np.float32)
+        self.rewards = np.empty(max_path_length, dtype=np.float32)
+        self.next_obs = np.empty((max_path_length,) + ob_shape, dtype=np.float32)
+        self.terminals = np.empty(max_path_length, dtype=np.float32)
+        self.image_obs = []
+        self.steps = 0
+
+    def add(self, ob, ac, rew, next_ob, terminal):
+        t = self.steps
+        self.obs[t] = ob
+        self.acs[t] = ac
+        self.rewards[t] = rew
+        self.next_obs[t] = next_ob
+        self.terminals[t] = terminal
+        self.steps += 1
+
+    def add_image(self, image):
+        self.image_obs.append(image)
+
+    def build(self):
+        t = self.steps
+        if self.image_obs:
+            image_obs = np.stack(self.image_obs, axis=0).astype(np.uint8)
+        else:
+            image_obs = np.array([], dtype=np.uint8)
+        return {"observation": self.obs[:t],
+                "image_obs": image_obs,
+                "reward": self.rewards[:t],
+                "action": self.acs[:t],
+                "next_observation": self.next_obs[:t],
+                "terminal": self.terminals[:t]}
+
+
 def convert_listofrollouts(paths, concat_rew=True):
     """
         Take a list of rollout dictionaries
@@ -9,6 +9,7 @@ import torch
 
 from cs285.infrastructure import pytorch_util as ptu
 from cs285.policies.base_policy import BasePolicy
+from cs285.policies.numpy_policy import NumpyMLPPolicy
 
 
 class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
@@ -71,6 +72,14 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
     def save(self, filepath):
         torch.save(self.state_dict(), filepath)
 
+    def to_numpy_policy(self):
+        """
+            A NumpyMLPPolicy with the current weights, for fast rollouts
+        """
+        if self.discrete:
+            return NumpyMLPPolicy.from_sequential(self.logits_na)
+        return NumpyMLPPolicy.from_sequential(self.mean_net)
+
     ##################################
 
     def get_action(self, obs: np.ndarray) -> np.ndarray:
@@ -2,6 +2,7 @@ import numpy as np
 
 from cs285.infrastructure import pytorch_util as ptu
 from .base_policy import BasePolicy
+from .numpy_policy import NumpyMLPPolicy
 from torch import nn
 import torch
 import pickle
@@ -92,6 +93,7 @@ class LoadedGaussianPolicy(BasePolicy, nn.Module):
             queries it. Do not try to train it.
         """)
 
+    @torch.no_grad()
     def get_action(self, obs):
         if len(obs.shape) > 1:
             observation = obs
@@ -103,3 +105,14 @@ class LoadedGaussianPolicy(BasePolicy, nn.Module):
 
     def save(self, filepath):
         torch.save(self.state_dict(), filepath)
+
+    def to_numpy_policy(self):
+        """
+            A NumpyMLPPolicy computing the same actions, for fast rollouts
+        """
+        linear_layers = list(self.hidden_layers) + [self.output_layer]
+        activations = [self.non_lin] * len(self.hidden_layers) + [nn.Identity()]
+        return NumpyMLPPolicy(
+            linear_layers, activations,
+            obs_mean=ptu.to_numpy(self.obs_norm_mean),
+            obs_std=ptu.to_numpy(self.obs_norm_std) + 1e-6)
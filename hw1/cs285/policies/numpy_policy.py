@@ -0,0 +1,114 @@
+import numpy as np
+from torch import nn
+
+from .base_policy import BasePolicy
+
+
+def _leaky_relu(negative_slope):
+    def activation(x):
+        return np.maximum(x, negative_slope * x, out=x)
+    return activation
+
+
+def _tanh(x):
+    return np.tanh(x, out=x)
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _softplus(x):
+    return np.logaddexp(x, 0, out=x)
+
+
+def _numpy_activation(module):
+    """
+        The NumPy version of a torch activation module (None for the identity)
+    """
+    if isinstance(module, nn.Identity):
+        return None
+    if isinstance(module, nn.Tanh):
+        return _tanh
+    if isinstance(module, nn.ReLU):
+        return _relu
+    if isinstance(module, nn.LeakyReLU):
+        return _leaky_relu(module.negative_slope)
+    if isinstance(module, nn.Sigmoid):
+        return _sigmoid
+    if isinstance(module, nn.Softplus):
+        return _softplus
+    raise NotImplementedError(
+        'No NumPy version of activation {}'.format(type(module).__name__))
+
+
+class NumpyMLPPolicy(BasePolicy):
+    """
+        Inference-only copy of a feedforward policy, with its weights exported
+        into contiguous float32 NumPy arrays.
+
+        get_action runs the chain of matmuls without going through torch, which
+        is faster for the single observations and small batches of rollout
+        collection. The copy does not follow later updates of the torch
+        policy, so export a new one after training.
+    """
+
+    def __init__(self, linear_layers, activations, obs_mean=None, obs_std=None):
+        """
+            linear_layers: the nn.Linear layers, in order
+            activations: the activation modules applied after each of them
+            obs_mean, obs_std: if given, the network is applied to
+                (obs - obs_mean) / obs_std
+        """
+        assert len(linear_layers) == len(activations)
+        # stored as (in_features, out_features), so that layers are h @ W + b
+        self.weights = [np.ascontiguousarray(layer.weight.detach().cpu().numpy().T, dtype=np.float32)
+                        for layer in linear_layers]
+        self.biases = [np.ascontiguousarray(layer.bias.detach().cpu().numpy(), dtype=np.float32)
+                       for layer in linear_layers]
+        self.activations = [_numpy_activation(activation) for activation in activations]
+
+        # not folded into the first layer, which loses precision in float32
+        # for features with a tiny std
+        if obs_mean is not None:
+            self.obs_mean = np.asarray(obs_mean, dtype=np.float32).reshape(-1)
+            self.obs_scale = (1 / np.asarray(obs_std, dtype=np.float64)).astype(np.float32).reshape(-1)
+        else:
+            self.obs_mean = None
+            self.obs_scale = None
+
+    @classmethod
+    def from_sequential(cls, net, obs_mean=None, obs_std=None):
+        """
+            Export an nn.Sequential of nn.Linear layers, each followed by an
+            activation (as built by ptu.build_mlp)
+        """
+        linear_layers = []
+        activations = []
+        for module in net:
+            if isinstance(module, nn.Linear):
+                linear_layers.append(module)
+                activations.append(nn.Identity())
+            else:
+                activations[-1] = module
+        return cls(linear_layers, activations, obs_mean, obs_std)
+
+    def get_action(self, obs):
+        if len(obs.shape) > 1:
+            h = obs
+        else:
+            h = obs[None]
+        h = h.astype(np.float32)
+        if self.obs_mean is not None:
+            h -= self.obs_mean
+            h *= self.obs_scale
+        for W, b, activation in zip(self.weights, self.biases, self.activations):
+            h = h @ W
+            h += b
+            if activation is not None:
+                h = activation(h)
+        return h
@@ -0,0 +1,19 @@
+import os
+
+from cs285.infrastructure.expert_data import convert_expert_data
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--expert_data', '-ed', type=str, required=True)  # expert_data_*.pkl file to convert
+    parser.add_argument('--output_dir', '-o', type=str)  # defaults to the pkl path without its extension
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.splitext(args.expert_data)[0]
+    convert_expert_data(args.expert_data, output_dir)
+    print('Converted', args.expert_data, 'to', output_dir)
+
+
+if __name__ == "__main__":
+    main()
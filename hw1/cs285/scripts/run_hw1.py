@@ -57,7 +57,7 @@ def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--expert_policy_file', '-epf', type=str, required=True)  # relative to where you're running this script from
-    parser.add_argument('--expert_data', '-ed', type=str, required=True) #relative to where you're running this script from
+    parser.add_argument('--expert_data', '-ed', type=str, required=True) #relative to where you're running this script from; a pkl file or a directory converted by convert_expert_data.py
     parser.add_argument('--env_name', '-env', type=str, help=f'choices: {", ".join(MJ_ENV_NAMES)}', required=True)
     parser.add_argument('--exp_name', '-exp', type=str, default='pick an experiment name', required=True)
     parser.add_argument('--do_dagger', action='store_true')
@@ -71,6 +71,12 @@ def main():
                         default=1000)  # eval data collected (in the env) for logging metrics
     parser.add_argument('--train_batch_size', type=int,
                         default=100)  # number of sampled data points to be used per gradient/train step
+    parser.add_argument('--num_envs', type=int, default=1)  # env copies stepped in lockstep when collecting rollouts
+    parser.add_argument('--num_workers', type=int, default=0)  # worker processes collecting rollouts in parallel (0 = in-process)
+    parser.add_argument('--async_eval', action='store_true')  # run eval rollouts in a background process while training continues
+    parser.add_argument('--numpy_inference', action='store_true')  # collect rollouts with a NumPy copy of the policy instead of torch
+    parser.add_argument('--relabel_chunk_size', type=int, default=10000)  # observations the expert labels per forward pass when relabelling for dagger
+    parser.add_argument('--relabel_num_workers', type=int, default=0)  # threads running those forward passes (0 = in the main thread)
 
     parser.add_argument('--n_layers', type=int, default=2)  # depth, of policy to be learned
     parser.add_argument('--size', type=int, default=64)  # width of each layer, of policy to be learned
@@ -1,6 +1,7 @@
 import numpy as np
 # Weird it's not mentioned in comments
-from cs285.infrastructure.utils import normalize
+from cs285.infrastructure.utils import normalize, discounted_cumsum, discounted_return, gae_advantages, rollout_terminals
+from cs285.infrastructure.utils import RunningMeanStd
 from .base_agent import BaseAgent
 from cs285.policies.MLP_policy import MLPPolicyPG
 from cs285.infrastructure.replay_buffer import ReplayBuffer
@@ -20,6 +21,13 @@ class PGAgent(BaseAgent):
         self.reward_to_go = self.agent_params['reward_to_go']
         self.gae_lambda = self.agent_params['gae_lambda']
 
+        # statistics of the q_values of all the batches so far, to scale the
+        # baseline with instead of those of the current batch
+        if self.agent_params['running_q_stats']:
+            self.q_stats = RunningMeanStd()
+        else:
+            self.q_stats = None
+
         # actor/policy
         self.actor = MLPPolicyPG(
             self.agent_params['ac_dim'],
@@ -28,7 +36,12 @@ class PGAgent(BaseAgent):
             self.agent_params['size'],
             discrete=self.agent_params['discrete'],
             learning_rate=self.agent_params['learning_rate'],
-            nn_baseline=self.agent_params['nn_baseline']
+            nn_baseline=self.agent_params['nn_baseline'],
+            num_epochs=self.agent_params['num_policy_epochs'],
+            minibatch_size=self.agent_params['policy_minibatch_size'],
+            target_kl=self.agent_params['target_kl'],
+            clip_ratio=self.agent_params['clip_ratio'],
+            q_stats=self.q_stats,
         )
 
         # replay buffer
@@ -46,8 +59,10 @@ class PGAgent(BaseAgent):
 
         # Compute the Q values
         q_vals = self.calculate_q_vals(rewards_list=rewards_list)
+        if self.q_stats is not None:
+            self.q_stats.update(q_vals)
         advantages = self.estimate_advantage(
-            observations, rewards_list, q_vals, terminals)
+            observations, rewards_list, q_vals, terminals, next_observations)
 
         # Update the agent policy
         train_log = self.actor.update(
@@ -77,20 +92,26 @@ class PGAgent(BaseAgent):
         # dimension corresponds to trajectories and the second corresponds
         # to timesteps
 
+        # both are computed for all the rollouts at once, on their
+        # concatenated rewards
+        rewards = np.concatenate(rewards_list)
+        terminals = rollout_terminals([len(r) for r in rewards_list])
         if not self.reward_to_go:
-            q_values = map(self._discounted_return, rewards_list)
+            return discounted_return(rewards, self.gamma, terminals)
 
         # Case 2: reward-to-go PG
         # Estimate Q^{pi}(s_t, a_t) by the discounted sum of rewards starting from t
         else:
-            q_values = map(self._discounted_cumsum, rewards_list)
+            return discounted_cumsum(rewards, self.gamma, terminals)
 
-        # concat arrays
-        return np.concatenate(list(q_values))
-
-    def estimate_advantage(self, obs: np.ndarray, rews_list: np.ndarray, q_values: np.ndarray, terminals: np.ndarray):
+    def estimate_advantage(self, obs: np.ndarray, rews_list: np.ndarray, q_values: np.ndarray, terminals: np.ndarray,
+                           next_obs: np.ndarray = None):
         """
             Computes advantages by (possibly) using GAE, or subtracting a baseline from the estimated Q values
+
+            With GAE, rollouts that end without their terminal flag set (cut
+            off at ep_len steps, or by the env's time limit) are bootstrapped
+            from the value of their last next_obs, if it is given
         """
 
         # Estimate the advantage when nn_baseline is True,
@@ -106,48 +127,55 @@ class PGAgent(BaseAgent):
 
             # https://stats.stackexchange.com/questions/46429/transform-data-to-desired-mean-and-standard-deviation
 
-            # define values to use
-            q_mu = np.mean(q_values)
-            q_std = np.std(q_values)
-            v_mu = np.mean(values_unnormalized)
-            v_std = np.std(values_unnormalized)
-            # Calculate new set
-            values = values_unnormalized*(q_std/v_std)
-            values = values + q_mu-v_mu*(q_std/v_std)
-            # Assert correct
-            assert isclose(np.mean(values), q_mu, abs_tol=1e-4)
-            assert isclose(np.std(values), q_std, abs_tol=1e-4)
+            if self.q_stats is not None:
+                # the baseline was trained on q_values normalized with the
+                # running statistics, so undo that normalization
+                value_scale = self.q_stats.std
+                value_shift = self.q_stats.mean
+                values = values_unnormalized*value_scale + value_shift
+            else:
+                # define values to use
+                q_mu = np.mean(q_values)
+                q_std = np.std(q_values)
+                v_mu = np.mean(values_unnormalized)
+                v_std = np.std(values_unnormalized)
+                # Calculate new set
+                value_scale = q_std/v_std
+                value_shift = q_mu-v_mu*value_scale
+                values = values_unnormalized*value_scale + value_shift
+                # Assert correct
+                assert isclose(np.mean(values), q_mu, abs_tol=1e-4)
+                assert isclose(np.std(values), q_std, abs_tol=1e-4)
 
             if self.gae_lambda is not None:
-                # append a dummy T+1 value for simpler recursive calculation
-                values = np.append(values, [0])
-
                 # combine rews_list into a single array
                 rews = np.concatenate(rews_list)
 
-                # create empty numpy array to populate with GAE advantage
-                # estimates, with dummy T+1 value for simpler recursive calculation
-                batch_size = obs.shape[0]
-                advantages = np.zeros(batch_size + 1)
-
-                for i in reversed(range(batch_size)):
-                    # TODO recursively compute advantage estimates starting from
-                    # timestep T.
-                    # HINT: use terminals to handle edge cases. terminals[i]
-                    # is 1 if the state is the last in its trajectory, and
-                    # 0 otherwise.
-
-                    # Edgecase where we don't have the values[i+1]
-                    if terminals[i] == 1:
-                        advantages[i] = rews[i]-values[i]
-                        continue
-                    # The ordinary case as described by (21) in the problem formulation
-                    delta_t = (rews[i] + self.gamma * values[i+1] - values[i])
-                    advantages[i] = delta_t + self.gamma * \
-                        self.gae_lambda*advantages[i+1]
-
-                # remove dummy advantage
-                advantages = advantages[:-1]
+                # within a rollout, the value of the next observation is that
+                # of the next timestep; terminals[t] is 1 only where the env
+                # terminated, so there is nothing to bootstrap from
+                next_values = np.append(values[1:], [0])
+                dones = np.array(terminals, dtype=np.float64)
+
+                # the rollouts that end without terminating were cut off, and
+                # bootstrap from the value of their last next_obs instead of
+                # the first observation of the next rollout
+                lengths = np.array([len(r) for r in rews_list])
+                ends = np.cumsum(lengths) - 1
+                truncated_ends = ends[dones[ends] == 0]
+                if len(truncated_ends) > 0:
+                    if next_obs is not None:
+                        next_values_unnormalized = np.atleast_1d(
+                            self.actor.run_baseline_prediction(next_obs[truncated_ends]))
+                        next_values[truncated_ends] = next_values_unnormalized*value_scale + value_shift
+                    else:
+                        next_values[truncated_ends] = 0
+
+                # all the rollouts at once, as a reverse scan that restarts at
+                # the end of every rollout
+                advantages = gae_advantages(
+                    rews, values, next_values, dones, rollout_terminals(lengths),
+                    self.gamma, self.gae_lambda)
 
             else:
                 # TODO compute advantage estimates using q_values, and values as baselines
@@ -186,15 +214,7 @@ class PGAgent(BaseAgent):
 
             Output: list where each index t contains sum_{t'=0}^T gamma^t' r_{t'}
         """
-        list_of_discounted_returns = np.ones(len(rewards))
-
-        # each element of the sum
-        _sum = sum([np.power(self.gamma, i)*rewards[i]
-                   for i in range(len(rewards))])
-        # Add sum to list of discounted returns
-        list_of_discounted_returns *= _sum
-
-        return list_of_discounted_returns
+        return discounted_return(rewards, self.gamma, rollout_terminals([len(rewards)]))
 
     def _discounted_cumsum(self, rewards):
         """
@@ -203,12 +223,4 @@ class PGAgent(BaseAgent):
             -and returns a list where the entry in each index t' is sum_{t'=t}^T gamma^(t'-t) * r_{t'}
 
         """
-        list_of_discounted_cumsums = []
-        T = len(rewards)
-        for i in range(T):
-            _idx = np.arange(i, T)
-            _sum_step = np.sum(
-                np.power(self.gamma, _idx-i) * rewards[_idx])
-            list_of_discounted_cumsums.append(_sum_step)
-
-        return np.array(list_of_discounted_cumsums)
+        return discounted_cumsum(rewards, self.gamma, rollout_terminals([len(rewards)]))
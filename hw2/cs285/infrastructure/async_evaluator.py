@@ -0,0 +1,100 @@
+import copy
+import multiprocessing as mp
+from collections import OrderedDict
+
+import gym
+import numpy as np
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+from cs285.infrastructure.parallel_sampler import CLOSE_TIMEOUT
+from cs285.infrastructure.action_noise_wrapper import ActionNoiseWrapper
+from cs285.infrastructure import utils
+
+
+class AsyncEvaluator(object):
+    """
+        Runs the eval rollouts of perform_logging in a background process, so
+        they overlap with the next collect/train cycle.
+
+        submit() snapshots the policy weights for an iteration; poll() returns
+        the (itr, logs) pairs of the evaluations that have finished since.
+    """
+
+    def __init__(self, params, policy):
+        ctx = mp.get_context('spawn')
+        self.remote, worker_remote = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker,
+            args=(worker_remote, params['env_name'], params['action_noise_std'],
+                  # keep the eval env's seed away from the training envs'
+                  params['seed'] + 1000,
+                  copy.deepcopy(policy).to('cpu'),
+                  params['eval_batch_size'], params['ep_len']),
+            daemon=True,
+        )
+        self.process.start()
+        worker_remote.close()
+        self.num_pending = 0
+
+    def submit(self, itr, policy):
+        state_dict = {k: v.cpu().numpy() for k, v in policy.state_dict().items()}
+        self.remote.send(('eval', (itr, state_dict)))
+        self.num_pending += 1
+
+    def poll(self, block=False):
+        results = []
+        while self.num_pending > 0 and (block or self.remote.poll()):
+            results.append(self.remote.recv())
+            self.num_pending -= 1
+        return results
+
+    def close(self):
+        # also called when training stops with an error, with the worker
+        # possibly gone or in the middle of an eval nobody will wait for
+        try:
+            self.remote.send(('close', None))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=CLOSE_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def _worker(remote, env_name, action_noise_std, seed, policy, eval_batch_size, ep_len):
+    ptu.device = torch.device('cpu')
+    torch.set_num_threads(1)
+
+    env = gym.make(env_name)
+    env.seed(seed)
+    if action_noise_std > 0:
+        env = ActionNoiseWrapper(env, seed, action_noise_std)
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'eval':
+                itr, state_dict = data
+                policy.load_state_dict(
+                    {k: torch.from_numpy(v) for k, v in state_dict.items()})
+                with torch.no_grad():
+                    eval_paths, _ = utils.sample_trajectories(
+                        env, policy, eval_batch_size, ep_len)
+
+                eval_returns = [eval_path["reward"].sum()
+                                for eval_path in eval_paths]
+                eval_ep_lens = [len(eval_path["reward"])
+                                for eval_path in eval_paths]
+
+                logs = OrderedDict()
+                logs["Eval_AverageReturn"] = np.mean(eval_returns)
+                logs["Eval_StdReturn"] = np.std(eval_returns)
+                logs["Eval_MaxReturn"] = np.max(eval_returns)
+                logs["Eval_MinReturn"] = np.min(eval_returns)
+                logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
+                remote.send((itr, logs))
+            elif cmd == 'close':
+                break
+    finally:
+        env.close()
@@ -13,6 +13,8 @@ from cs285.infrastructure import pytorch_util as ptu
 from cs285.infrastructure import utils
 from cs285.infrastructure.logger import Logger
 from cs285.infrastructure.action_noise_wrapper import ActionNoiseWrapper
+from cs285.infrastructure.parallel_sampler import ParallelSampler
+from cs285.infrastructure.async_evaluator import AsyncEvaluator
 
 # how many rollouts to save as videos to tensorboard
 MAX_NVIDEO = 2
@@ -57,6 +59,20 @@ class RL_Trainer(object):
             self.env = ActionNoiseWrapper(
                 self.env, seed, params['action_noise_std'])
 
+        # Extra copies of the env, stepped in lockstep with self.env so that
+        # the policy is queried once per tick when collecting rollouts
+        if self.params['num_envs'] > 1:
+            self.rollout_env = [self.env]
+            for i in range(1, self.params['num_envs']):
+                env = gym.make(self.params['env_name'], render_mode=render_mode)
+                env.seed(seed + i)
+                if params['action_noise_std'] > 0:
+                    env = ActionNoiseWrapper(
+                        env, seed + i, params['action_noise_std'])
+                self.rollout_env.append(env)
+        else:
+            self.rollout_env = self.env
+
         # import plotting (locally if 'obstacles' env)
         if not (self.params['env_name'] == 'obstacles-cs285-v0'):
             import matplotlib
@@ -116,46 +132,70 @@ class RL_Trainer(object):
         self.total_envsteps = 0
         self.start_time = time.time()
 
-        for itr in range(n_iter):
-            print("\n\n********** Iteration %i ************" % itr)
-
-            # decide if videos should be rendered/logged at this iteration
-            if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
-                self.logvideo = True
-            else:
-                self.logvideo = False
-
-            # decide if metrics should be logged
-            if self.params['scalar_log_freq'] == -1:
-                self.logmetrics = False
-            elif itr % self.params['scalar_log_freq'] == 0:
-                self.logmetrics = True
-            else:
-                self.logmetrics = False
-
-            # collect trajectories, to be used for training
-            training_returns = self.collect_training_trajectories(itr,
-                                                                  initial_expertdata, collect_policy,
-                                                                  self.params['batch_size'])
-            paths, envsteps_this_batch, train_video_paths = training_returns
-            self.total_envsteps += envsteps_this_batch
-
-            # add collected data to replay buffer
-            self.agent.add_to_replay_buffer(paths)
-
-            # train agent (using sampled data from replay buffer)
-            train_logs = self.train_agent()
-
-            # log/save
-            if self.logvideo or self.logmetrics:
-                # perform logging
-                print('\nBeginning logging procedure...')
-                self.perform_logging(
-                    itr, paths, eval_policy, train_video_paths, train_logs)
+        # worker processes that collect rollouts in parallel
+        if self.params['num_workers'] > 0:
+            self.sampler = ParallelSampler(
+                self.params, collect_policy, self.params['num_workers'])
+        else:
+            self.sampler = None
 
-                if self.params['save_params']:
-                    self.agent.save(
-                        '{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+        # background process that runs the eval rollouts while we keep training
+        if self.params['async_eval']:
+            self.evaluator = AsyncEvaluator(self.params, eval_policy)
+        else:
+            self.evaluator = None
+
+        # the workers and their shared memory are freed whichever way
+        # training stops
+        try:
+            for itr in range(n_iter):
+                print("\n\n********** Iteration %i ************" % itr)
+
+                # decide if videos should be rendered/logged at this iteration
+                if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
+                    self.logvideo = True
+                else:
+                    self.logvideo = False
+
+                # decide if metrics should be logged
+                if self.params['scalar_log_freq'] == -1:
+                    self.logmetrics = False
+                elif itr % self.params['scalar_log_freq'] == 0:
+                    self.logmetrics = True
+                else:
+                    self.logmetrics = False
+
+                # collect trajectories, to be used for training
+                training_returns = self.collect_training_trajectories(itr,
+                                                                      initial_expertdata, collect_policy,
+                                                                      self.params['batch_size'])
+                paths, envsteps_this_batch, train_video_paths = training_returns
+                self.total_envsteps += envsteps_this_batch
+
+                # add collected data to replay buffer
+                self.agent.add_to_replay_buffer(paths)
+
+                # train agent (using sampled data from replay buffer)
+                train_logs = self.train_agent()
+
+                # log/save
+                if self.logvideo or self.logmetrics:
+                    # perform logging
+                    print('\nBeginning logging procedure...')
+                    self.perform_logging(
+                        itr, paths, eval_policy, train_video_paths, train_logs)
+
+                    if self.params['save_params']:
+                        self.agent.save(
+                            '{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
+
+            if self.evaluator is not None:
+                self.log_async_eval(self.evaluator.poll(block=True))
+        finally:
+            if self.sampler is not None:
+                self.sampler.close()
+            if self.evaluator is not None:
+                self.evaluator.close()
 
     ####################################
     ####################################
@@ -191,8 +231,12 @@ class RL_Trainer(object):
         # HINT1: use sample_trajectories from utils
         # HINT2: you want each of these collected rollouts to be of length self.params['ep_len']
         print("\nCollecting data to be used for training...")
-        paths, envsteps_this_batch = utils.sample_trajectories(
-            self.env, collect_policy, self.params['batch_size'], self.params['ep_len'])
+        if self.sampler is not None:
+            paths, envsteps_this_batch = self.sampler.sample_trajectories(
+                collect_policy, self.params['batch_size'], self.params['ep_len'])
+        else:
+            paths, envsteps_this_batch = utils.sample_trajectories(
+                self.rollout_env, collect_policy, self.params['batch_size'], self.params['ep_len'])
 
         # collect more rollouts with the same policy, to be saved as videos in tensorboard
         # note: here, we collect MAX_NVIDEO rollouts, each of length MAX_VIDEO_LEN
@@ -234,9 +278,19 @@ class RL_Trainer(object):
         #######################
 
         # collect eval trajectories, for logging
-        print("\nCollecting data for eval...")
-        eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(
-            self.env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+        if self.evaluator is not None:
+            # the Eval_* metrics get logged under this itr once they are done
+            if self.logmetrics:
+                print("\nSubmitting policy for async eval...")
+                self.evaluator.submit(itr, eval_policy)
+        else:
+            print("\nCollecting data for eval...")
+            if self.sampler is not None:
+                eval_paths, eval_envsteps_this_batch = self.sampler.sample_trajectories(
+                    eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
+            else:
+                eval_paths, eval_envsteps_this_batch = utils.sample_trajectories(
+                    self.rollout_env, eval_policy, self.params['eval_batch_size'], self.params['ep_len'])
 
         # save eval rollouts as videos in tensorboard event file
         if self.logvideo and train_video_paths != None:
@@ -257,21 +311,23 @@ class RL_Trainer(object):
         if self.logmetrics:
             # returns, for logging
             train_returns = [path["reward"].sum() for path in paths]
-            eval_returns = [eval_path["reward"].sum()
-                            for eval_path in eval_paths]
 
             # episode lengths, for logging
             train_ep_lens = [len(path["reward"]) for path in paths]
-            eval_ep_lens = [len(eval_path["reward"])
-                            for eval_path in eval_paths]
 
             # decide what to log
             logs = OrderedDict()
-            logs["Eval_AverageReturn"] = np.mean(eval_returns)
-            logs["Eval_StdReturn"] = np.std(eval_returns)
-            logs["Eval_MaxReturn"] = np.max(eval_returns)
-            logs["Eval_MinReturn"] = np.min(eval_returns)
-            logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
+            if self.evaluator is None:
+                eval_returns = [eval_path["reward"].sum()
+                                for eval_path in eval_paths]
+                eval_ep_lens = [len(eval_path["reward"])
+                                for eval_path in eval_paths]
+
+                logs["Eval_AverageReturn"] = np.mean(eval_returns)
+                logs["Eval_StdReturn"] = np.std(eval_returns)
+                logs["Eval_MaxReturn"] = np.max(eval_returns)
+                logs["Eval_MinReturn"] = np.min(eval_returns)
+                logs["Eval_AverageEpLen"] = np.mean(eval_ep_lens)
 
             logs["Train_AverageReturn"] = np.mean(train_returns)
             logs["Train_StdReturn"] = np.std(train_returns)
@@ -294,3 +350,16 @@ class RL_Trainer(object):
             print('Done logging...\n\n')
 
             self.logger.flush()
+
+        # log whichever async evals have finished by now
+        if self.evaluator is not None:
+            self.log_async_eval(self.evaluator.poll())
+
+    def log_async_eval(self, results):
+        for itr, logs in results:
+            print('\nAsync eval results for iteration %i' % itr)
+            for key, value in logs.items():
+                print('{} : {}'.format(key, value))
+                self.logger.log_scalar(value, key, itr)
+        if results:
+            self.logger.flush()
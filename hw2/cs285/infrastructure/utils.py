@@ -1,6 +1,7 @@
 import numpy as np
 import time
 import copy
+import torch
 from cs285.policies.MLP_policy import MLPPolicy
 from gym import Env
 
@@ -32,25 +33,18 @@ def calculate_mean_prediction_error(env, action_sequence, models, data_statistic
 
 def perform_actions(env, actions):
     ob = env.reset()
-    obs, acs, rewards, next_obs, terminals, image_obs = [], [], [], [], [], []
-    steps = 0
+    traj = TrajectoryBuilder(env, len(actions))
     for ac in actions:
-        obs.append(ob)
-        acs.append(ac)
-        ob, rew, done, _ = env.step(ac)
+        next_ob, rew, done, _ = env.step(ac)
         # add the observation after taking a step to next_obs
-        next_obs.append(ob)
-        rewards.append(rew)
-        steps += 1
         # If the episode ended, the corresponding terminal value is 1
         # otherwise, it is 0
+        traj.add(ob, ac, rew, next_ob, done)
+        ob = next_ob
         if done:
-            terminals.append(1)
             break
-        else:
-            terminals.append(0)
 
-    return Path(obs, image_obs, acs, rewards, next_obs, terminals)
+    return traj.build()
 
 
 def mean_squared_error(a, b):
@@ -67,54 +61,57 @@ def sample_trajectory(env: Env, policy: MLPPolicy, max_path_length, render=False
     ob = env.reset()  # HINT: should be the output of resetting the env
 
     # init vars
-    obs, acs, rewards, next_obs, terminals, image_obs = [], [], [], [], [], []
-    steps = 0
+    traj = TrajectoryBuilder(env, max_path_length)
     while True:
 
         # render image of the simulated env
         if render:
             if hasattr(env, 'sim'):
-                image_obs.append(env.sim.render(
+                traj.add_image(env.sim.render(
                     camera_name='track', height=500, width=500)[::-1])
             else:
-                image_obs.append(env.render())
+                traj.add_image(env.render())
 
         # use the most recent ob to decide what to do
-        obs.append(ob)
         # HINT: query the policy's get_action function
         ac = policy.get_action(ob)
         ac = ac[0]
-        acs.append(ac)
 
         # take that action and record results
-        ob, rew, done, _ = env.step(ac)
-
-        # record result of taking that action
-        steps += 1
-        next_obs.append(ob)
-        rewards.append(rew)
+        next_ob, rew, done, info = env.step(ac)
 
         # TODO end the rollout if the rollout ended
         # HINT: rollout can end due to done, or due to max_path_length
         # Using logic from get path length
         # HINT: this is either 0 or 1
-        rollout_done = (done or len(rewards) >= max_path_length)
-        terminals.append(rollout_done)
+        rollout_done = (done or traj.steps + 1 >= max_path_length)
+
+        # record result of taking that action; the terminal flag is only set
+        # if the env terminated, not if the rollout was cut off
+        traj.add(ob, ac, rew, next_ob, env_terminated(done, info))
+        ob = next_ob
 
         if rollout_done:
             break
 
-    return Path(obs, image_obs, acs, rewards, next_obs, terminals)
+    return traj.build()
 
 
 def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, render=False):
     """
         Collect rollouts until we have collected min_timesteps_per_batch steps.
 
+        If env is a list of envs, they are stepped in lockstep
+        (see sample_trajectories_vectorized).
+
         TODO implement this function
         Hint1: use sample_trajectory to get each path (i.e. rollout) that goes into paths
         Hint2: use get_pathlength to count the timesteps collected in each path
     """
+    if isinstance(env, list):
+        return sample_trajectories_vectorized(
+            env, policy, min_timesteps_per_batch, max_path_length)
+
     timesteps_this_batch = 0
     paths = []
     while timesteps_this_batch < min_timesteps_per_batch:
@@ -125,6 +122,58 @@ def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, r
     return paths, timesteps_this_batch
 
 
+def sample_trajectories_vectorized(envs, policy, min_timesteps_per_batch, max_path_length):
+    """
+        Collect rollouts from several copies of an env stepped in lockstep,
+        querying the policy once per tick for all of them.
+
+        Finished sub-episodes are turned into paths as soon as they end. Once
+        min_timesteps_per_batch steps have been taken, envs are no longer reset,
+        but the episodes still in flight are run to completion so that only
+        full rollouts are returned.
+    """
+    num_envs = len(envs)
+    obs = np.stack([env.reset() for env in envs])
+    rollouts = [TrajectoryBuilder(env, max_path_length) for env in envs]
+    active = np.ones(num_envs, dtype=bool)
+
+    timesteps_this_batch = 0
+    paths = []
+    while active.any():
+        env_ids = np.flatnonzero(active)
+
+        # one batched forward pass for every env that is still running
+        acs = policy.get_action(obs[env_ids])
+
+        for env_id, ac in zip(env_ids, acs):
+            ob, rew, done, info = envs[env_id].step(ac)
+            timesteps_this_batch += 1
+
+            traj = rollouts[env_id]
+            rollout_done = (done or traj.steps + 1 >= max_path_length)
+            traj.add(obs[env_id], ac, rew, ob, env_terminated(done, info))
+
+            if rollout_done:
+                paths.append(traj.build())
+                if timesteps_this_batch < min_timesteps_per_batch:
+                    ob = envs[env_id].reset()
+                    rollouts[env_id] = TrajectoryBuilder(envs[env_id], max_path_length)
+                else:
+                    active[env_id] = False
+
+            obs[env_id] = ob
+
+    return paths, timesteps_this_batch
+
+
+def env_terminated(done, info):
+    """
+        Whether a step that returned done ended the episode for real, rather
+        than hitting the env's time limit
+    """
+    return done and not info.get('TimeLimit.truncated', False)
+
+
 def sample_n_trajectories(env, policy, ntraj, max_path_length, render=False):
     """
         Collect ntraj rollouts.
@@ -148,6 +197,10 @@ def Path(obs, image_obs, acs, rewards, next_obs, terminals):
     """
         Take info (separate arrays) from a single rollout
         and return it in a single dictionary
+
+        terminals[t] is 1 if the env terminated at step t; a rollout that was
+        cut off (at max_path_length, or by the env's time limit) has no
+        terminal step, and the rollout boundaries come from the path lengths
     """
     if image_obs != []:
         image_obs = np.stack(image_obs, axis=0)
@@ -159,6 +212,52 @@ def Path(obs, image_obs, acs, rewards, next_obs, terminals):
             "terminal": np.array(terminals, dtype=np.float32)}
 
 
+class TrajectoryBuilder(object):
+    """
+        Preallocates the arrays of a single rollout, sized from the env spaces
+        and the maximum number of steps, and writes each step into them in place.
+
+        build() returns the same dictionary as Path, with views trimmed to the
+        length of the rollout.
+    """
+
+    def __init__(self, env, max_path_length):
+        ob_shape = env.observation_space.shape
+        ac_shape = env.action_space.shape
+        self.obs = np.empty((max_path_length,) + ob_shape, dtype=np.float32)
+        self.acs = np.empty((max_path_length,) + ac_shape, dtype=np.float32)
+        self.rewards = np.empty(max_path_length, dtype=np.float32)
+        self.next_obs = np.empty((max_path_length,) + ob_shape, dtype=np.float32)
+        self.terminals = np.empty(max_path_length, dtype=np.float32)
+        self.image_obs = []
+        self.steps = 0
+
+    def add(self, ob, ac, rew, next_ob, terminal):
+        t = self.steps
+        self.obs[t] = ob
+        self.acs[t] = ac
+        self.rewards[t] = rew
+        self.next_obs[t] = next_ob
+        self.terminals[t] = terminal
+        self.steps += 1
+
+    def add_image(self, image):
+        self.image_obs.append(image)
+
+    def build(self):
+        t = self.steps
+        if self.image_obs:
+            image_obs = np.stack(self.image_obs, axis=0).astype(np.uint8)
+        else:
+            image_obs = np.array([], dtype=np.uint8)
+        return {"observation": self.obs[:t],
+                "image_obs": image_obs,
+                "reward": self.rewards[:t],
+                "action": self.acs[:t],
+                "next_observation": self.next_obs[:t],
+                "terminal": self.terminals[:t]}
+
+
 def convert_listofrollouts(paths):
     """
         Take a list of rollout dictionaries
@@ -209,3 +308,120 @@ def add_noise(data_inp, noiseToSignal=0.01):
             0, np.absolute(std_of_noise[j]), (data.shape[0],)))
 
     return data
+
+############################################
+############################################
+
+
+def discounted_cumsum(rewards, gamma, terminals):
+    """
+        Discounted sum of the future rewards of every timestep of a batch of
+        concatenated rollouts:
+
+            out[t] = rewards[t] + gamma * out[t+1] * (1 - terminals[t])
+
+        where terminals[t] is 1 at the last timestep of each rollout, so the
+        sum restarts at every rollout boundary.
+
+        Computed in float64 with a reverse scan over the whole batch, in
+        log2(T) vectorized steps instead of a loop over timesteps or rollouts.
+        If rewards is a tensor, so is the result, on the same device.
+    """
+    if torch.is_tensor(rewards):
+        values = rewards.to(torch.float64, copy=True)
+        terminals = torch.as_tensor(terminals, dtype=torch.float64, device=rewards.device)
+    else:
+        values = np.array(rewards, dtype=np.float64)
+        terminals = np.asarray(terminals, dtype=np.float64)
+    # after the step with shift s, values[t] holds the discounted sum of the
+    # rewards of timesteps t, ..., t+2s-1 (up to the end of t's rollout), and
+    # discounts[t] the discount of the sum that starts at t+2s (0 past the end
+    # of t's rollout)
+    discounts = gamma * (1 - terminals)
+    shift = 1
+    while shift < len(values):
+        values[:-shift] = values[:-shift] + discounts[:-shift] * values[shift:]
+        discounts[:-shift] = discounts[:-shift] * discounts[shift:]
+        shift *= 2
+    return values
+
+
+def discounted_return(rewards, gamma, terminals):
+    """
+        Discounted return of the whole rollout, at every timestep of a batch
+        of concatenated rollouts (with terminals as in discounted_cumsum)
+    """
+    cumsums = discounted_cumsum(rewards, gamma, terminals)
+    # the first timestep of each rollout, and the rollout of every timestep
+    is_start = np.concatenate([[True], np.asarray(terminals[:-1]) != 0])
+    rollout_ids = np.cumsum(is_start) - 1
+    return cumsums[np.flatnonzero(is_start)][rollout_ids]
+
+
+def gae_advantages(rewards, values, next_values, dones, terminals, gamma, gae_lambda):
+    """
+        Generalized advantage estimates of every timestep of a batch of
+        concatenated rollouts:
+
+            delta[t] = rewards[t] + gamma * next_values[t] * (1 - dones[t]) - values[t]
+            adv[t] = delta[t] + gamma * gae_lambda * adv[t+1] * (1 - terminals[t])
+
+        values[t] and next_values[t] are the value predictions for the
+        observation and the next observation of timestep t. dones[t] is 1 if
+        the env terminated at t, so there is nothing to bootstrap from, and
+        terminals[t] is 1 at the last timestep of each rollout, whether it
+        terminated or was truncated.
+
+        Works on numpy arrays, or on tensors (which then stay on their device).
+    """
+    deltas = rewards + gamma * next_values * (1 - dones) - values
+    return discounted_cumsum(deltas, gamma * gae_lambda, terminals)
+
+
+def rollout_terminals(lengths):
+    """
+        Terminal flags (1 at the last timestep of each rollout) of a batch of
+        concatenated rollouts with the given lengths
+    """
+    terminals = np.zeros(np.sum(lengths))
+    terminals[np.cumsum(lengths) - 1] = 1
+    return terminals
+
+
+class RunningMeanStd(object):
+    """
+        Running mean and variance of all the values seen so far, updated a
+        batch at a time.
+
+        Batches are folded in with the parallel-merge form of Welford's
+        algorithm (Chan et al.), which is also how statistics gathered
+        separately, e.g. by parallel workers, are combined with merge().
+    """
+
+    def __init__(self, shape=()):
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.var = np.zeros(shape, dtype=np.float64)
+        self.count = 0
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) > 0:
+            self._merge(np.mean(x, axis=0), np.var(x, axis=0), len(x))
+
+    def merge(self, other):
+        if other.count > 0:
+            self._merge(other.mean, other.var, other.count)
+
+    def _merge(self, batch_mean, batch_var, batch_count):
+        total_count = self.count + batch_count
+        delta = batch_mean - self.mean
+        # sums of squared deviations from the means, combined
+        m2 = (self.var * self.count + batch_var * batch_count
+              + np.square(delta) * self.count * batch_count / total_count)
+        self.mean = self.mean + delta * batch_count / total_count
+        self.var = m2 / total_count
+        self.count = total_count
@@ -1,5 +1,6 @@
 import abc
 import itertools
+import warnings
 from turtle import forward
 from torch import nn
 from torch.nn import functional as F
@@ -117,13 +118,11 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
             return action_distribution
         else:
             batch_mean = self.mean_net(observation)
-            scale_tril = torch.diag(torch.exp(self.logstd))
-            batch_dim = batch_mean.shape[0]
-            batch_scale_tril = scale_tril.repeat(batch_dim, 1, 1)
-            action_distribution = distributions.MultivariateNormal(
-                batch_mean,
-                scale_tril=batch_scale_tril,
-            )
+            # a diagonal Gaussian: independent Normals over the action
+            # dimensions, so log_prob and sample are elementwise, without
+            # building (and solving with) a covariance matrix per sample
+            action_distribution = distributions.Independent(
+                distributions.Normal(batch_mean, torch.exp(self.logstd)), 1)
             return action_distribution
 
 #####################################################
@@ -131,16 +130,41 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
 
 
 class MLPPolicyPG(MLPPolicy):
-    def __init__(self, ac_dim, ob_dim, n_layers, size, **kwargs):
-
+    def __init__(self, ac_dim, ob_dim, n_layers, size, num_epochs=1, minibatch_size=None,
+                 target_kl=None, clip_ratio=0.2, q_stats=None, **kwargs):
+        """
+            num_epochs, minibatch_size: by default, every update takes a single
+                gradient step on the whole batch; otherwise it takes num_epochs
+                passes over the batch, shuffled into minibatches of
+                minibatch_size (the whole batch if None)
+            target_kl: if given, stop the passes over the batch early once the
+                policy has moved this far (in approximate KL) from the one
+                that collected it; only used with num_epochs/minibatch_size,
+                as the single default step has nothing to stop early
+            clip_ratio: how far the importance ratio of those passes may move
+                from 1 before its gradient is cut off
+            q_stats: if given, a RunningMeanStd of the q_values, kept up to date
+                by the agent, to normalize the baseline targets with instead of
+                the statistics of each batch
+        """
         super().__init__(ac_dim, ob_dim, n_layers, size, **kwargs)
         self.baseline_loss = nn.MSELoss()
+        self.num_epochs = num_epochs
+        self.minibatch_size = minibatch_size
+        self.target_kl = target_kl
+        self.clip_ratio = clip_ratio
+        self.q_stats = q_stats
+        if target_kl is not None and num_epochs == 1 and minibatch_size is None:
+            warnings.warn('target_kl is ignored without num_epochs > 1 or a minibatch_size')
 
     def update(self, observations, actions, advantages, q_values=None):
         observations = ptu.from_numpy(observations)
         actions = ptu.from_numpy(actions)
         advantages = ptu.from_numpy(advantages)
 
+        if self.num_epochs > 1 or self.minibatch_size is not None:
+            return self._update_minibatches(observations, actions, advantages, q_values)
+
         # TODO update the policy using policy gradient
         # HINT1: Recall that the expression that we want to MAXIMIZE
         # is the expectation over collected trajectories of:
@@ -172,15 +196,14 @@ class MLPPolicyPG(MLPPolicy):
             # Don't know if we need to update both networks but seems like we do
 
             # Normalize q and make tensor
-            q_normed = ptu.from_numpy(
-                normalize(q_values, np.mean(q_values), np.std(q_values)))
+            q_normed = ptu.from_numpy(self._normalize_q_values(q_values))
 
             # Zero optimizer
             self.baseline_optimizer.zero_grad()
 
             # Calculate loss of forward pass in base network and normed q
             loss_base = self.baseline_loss(
-                self.baseline(observations), q_normed)
+                self.baseline(observations).squeeze(-1), q_normed)
 
             # backprop loss
             loss_base.backward()
@@ -194,6 +217,74 @@ class MLPPolicyPG(MLPPolicy):
         }
         return train_log
 
+    def _normalize_q_values(self, q_values):
+        if self.q_stats is not None:
+            return normalize(q_values, self.q_stats.mean, self.q_stats.std)
+        return normalize(q_values, np.mean(q_values), np.std(q_values))
+
+    def _minibatches(self, batch_size):
+        """
+            Indices of a random split of the batch into minibatches
+        """
+        minibatch_size = self.minibatch_size or batch_size
+        return torch.randperm(batch_size, device=ptu.device).split(minibatch_size)
+
+    def _update_minibatches(self, observations, actions, advantages, q_values):
+        """
+            The num_epochs/minibatch_size version of update. After the first
+            step the policy differs from the one that collected the batch, so
+            the log-probabilities are weighted by the importance ratio
+            pi(a|s) / pi_old(a|s), which has the same gradient as plain
+            policy gradient at pi == pi_old. The ratio is clipped to
+            [1 - clip, 1 + clip] PPO-style, and with target_kl the passes stop
+            at the first minibatch whose approximate KL exceeds it.
+        """
+        with torch.no_grad():
+            old_log_probs = self.forward(observations).log_prob(actions)
+
+        batch_size = len(observations)
+        approx_kl = 0.
+        stop = False
+        for epoch in range(self.num_epochs):
+            for idxs in self._minibatches(batch_size):
+                log_probs = self.forward(observations[idxs]).log_prob(actions[idxs])
+                log_ratio = log_probs - old_log_probs[idxs]
+                with torch.no_grad():
+                    # (r - 1) - log r: nonnegative, unbiased estimate of KL(pi_old || pi)
+                    approx_kl = torch.mean(torch.expm1(log_ratio) - log_ratio).item()
+                if self.target_kl is not None and approx_kl > self.target_kl:
+                    stop = True
+                    break
+
+                ratio = torch.exp(log_ratio)
+                clipped_ratio = torch.clamp(ratio, 1 - self.clip_ratio, 1 + self.clip_ratio)
+                loss = -torch.mean(torch.min(
+                    ratio * advantages[idxs], clipped_ratio * advantages[idxs]))
+
+                self.optimizer.zero_grad()
+                loss.backward()
+                self.optimizer.step()
+            if stop:
+                break
+
+        if self.nn_baseline:
+            # the baseline regression is not affected by the early stop
+            q_normed = ptu.from_numpy(self._normalize_q_values(q_values))
+            for _ in range(self.num_epochs):
+                for idxs in self._minibatches(batch_size):
+                    self.baseline_optimizer.zero_grad()
+                    loss_base = self.baseline_loss(
+                        self.baseline(observations[idxs]).squeeze(-1), q_normed[idxs])
+                    loss_base.backward()
+                    self.baseline_optimizer.step()
+
+        train_log = {
+            'Training Loss': ptu.to_numpy(loss),
+            'Policy Epochs': epoch + 1,
+            'Approx KL': approx_kl,
+        }
+        return train_log
+
     def run_baseline_prediction(self, observations):
         """
             Helper function that converts `observations` to a tensor,
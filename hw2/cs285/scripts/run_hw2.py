@@ -24,10 +24,15 @@ class PG_Trainer(object):
             'reward_to_go': params['reward_to_go'],
             'nn_baseline': params['nn_baseline'],
             'gae_lambda': params['gae_lambda'],
+            'running_q_stats': params['running_q_stats'],
         }
 
         train_args = {
             'num_agent_train_steps_per_iter': params['num_agent_train_steps_per_iter'],
+            'num_policy_epochs': params['num_policy_epochs'],
+            'policy_minibatch_size': params['policy_minibatch_size'],
+            'target_kl': params['target_kl'],
+            'clip_ratio': params['clip_ratio'],
         }
 
         agent_params = {**computation_graph_args, **estimate_advantage_args, **train_args}
@@ -63,12 +68,20 @@ def main():
     parser.add_argument('--reward_to_go', '-rtg', action='store_true')
     parser.add_argument('--nn_baseline', action='store_true')
     parser.add_argument('--gae_lambda', type=float, default=None)
+    parser.add_argument('--running_q_stats', action='store_true') #scale the baseline with the q_value statistics of all batches so far, not just the current one
     parser.add_argument('--dont_standardize_advantages', '-dsa', action='store_true')
     parser.add_argument('--batch_size', '-b', type=int, default=1000) #steps collected per train iteration
     parser.add_argument('--eval_batch_size', '-eb', type=int, default=400) #steps collected per eval iteration
     parser.add_argument('--train_batch_size', '-tb', type=int, default=1000) ##steps used per gradient step
+    parser.add_argument('--num_envs', type=int, default=1) #env copies stepped in lockstep when collecting rollouts
+    parser.add_argument('--num_workers', type=int, default=0) #worker processes collecting rollouts in parallel (0 = in-process)
+    parser.add_argument('--async_eval', action='store_true') #run eval rollouts in a background process while training continues
 
     parser.add_argument('--num_agent_train_steps_per_iter', type=int, default=1)
+    parser.add_argument('--num_policy_epochs', type=int, default=1) #passes over the batch per policy update
+    parser.add_argument('--policy_minibatch_size', type=int, default=None) #steps per gradient step in those passes (default: the whole batch)
+    parser.add_argument('--target_kl', type=float, default=None) #stop the passes early once the policy moved this far from the one that collected the batch (only with the passes above)
+    parser.add_argument('--clip_ratio', type=float, default=0.2) #PPO-style clip of the importance ratio in those passes
     parser.add_argument('--discount', type=float, default=1.0)
     parser.add_argument('--learning_rate', '-lr', type=float, default=5e-3)
     parser.add_argument('--n_layers', '-l', type=int, default=2)
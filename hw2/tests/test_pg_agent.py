@@ -0,0 +1,61 @@
+import numpy as np
+
+from cs285.agents.pg_agent import PGAgent
+
+GAMMA = 0.95
+GAE_LAMBDA = 0.9
+
+
+def _agent():
+    agent = PGAgent(None, {
+        'gamma': GAMMA, 'standardize_advantages': False, 'nn_baseline': True,
+        'reward_to_go': True, 'gae_lambda': GAE_LAMBDA, 'running_q_stats': True,
+        'ac_dim': 1, 'ob_dim': 1, 'n_layers': 1, 'size': 8, 'discrete': False,
+        'learning_rate': 1e-3, 'num_policy_epochs': 1, 'policy_minibatch_size': None,
+        'target_kl': None, 'clip_ratio': 0.2,
+    })
+    # unit running statistics, so the values are the baseline's predictions,
+    # which are taken to be the (only) observation feature
+    agent.q_stats.update([-1., 1.])
+    agent.actor.run_baseline_prediction = lambda obs: obs[:, 0].copy()
+    return agent
+
+
+def _old_gae_loop(rews, values, next_values, terminals, ends):
+    """The per-timestep loop GAE was computed with before, plus a bootstrap
+    from next_values at the end of a rollout that did not terminate."""
+    values = np.append(values, [0])
+    advantages = np.zeros(len(rews) + 1)
+    for i in reversed(range(len(rews))):
+        if i in ends:
+            if terminals[i] == 1:
+                advantages[i] = rews[i] - values[i]
+            else:
+                advantages[i] = rews[i] + GAMMA * next_values[i] - values[i]
+            continue
+        delta_t = rews[i] + GAMMA * values[i + 1] - values[i]
+        advantages[i] = delta_t + GAMMA * GAE_LAMBDA * advantages[i + 1]
+    return advantages[:-1]
+
+
+def test_gae_bootstraps_truncated_rollouts_only():
+    # with ep_len 4: terminated at ep_len, terminated after one step, cut off
+    # by a time limit before ep_len, and cut off at ep_len
+    lengths = [4, 1, 3, 4]
+    terminated = [True, True, False, False]
+    rng = np.random.RandomState(0)
+    rews_list = [rng.randn(length) for length in lengths]
+    ends = np.cumsum(lengths) - 1
+
+    obs = rng.randn(sum(lengths), 1)
+    next_obs = np.roll(obs, -1, axis=0)
+    next_obs[ends] = rng.randn(len(ends), 1)
+    terminals = np.zeros(sum(lengths))
+    terminals[ends[terminated]] = 1
+
+    advantages = _agent().estimate_advantage(
+        obs, rews_list, np.zeros(sum(lengths)), terminals, next_obs)
+
+    expected = _old_gae_loop(
+        np.concatenate(rews_list), obs[:, 0], next_obs[:, 0], terminals, set(ends))
+    assert np.abs(advantages - expected).max() < 1e-9
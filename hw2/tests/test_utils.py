@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import torch
+
+from cs285.infrastructure.utils import (
+    discounted_cumsum, discounted_return, gae_advantages, rollout_terminals)
+
+# ragged rollouts, including length-1 ones and one longer than a power of 2
+LENGTHS = [1, 5, 1, 17, 2, 64, 1, 3]
+
+
+def _rewards():
+    return np.random.RandomState(0).randn(sum(LENGTHS))
+
+
+def _per_rollout(rewards, lengths):
+    starts = np.cumsum(lengths) - lengths
+    return [rewards[start:start + length] for start, length in zip(starts, lengths)]
+
+
+def _naive_discounted_cumsum(rewards, gamma, lengths):
+    out = []
+    for rollout in _per_rollout(rewards, lengths):
+        out.extend(sum(gamma ** (k - t) * rollout[k] for k in range(t, len(rollout)))
+                   for t in range(len(rollout)))
+    return np.array(out)
+
+
+def _naive_discounted_return(rewards, gamma, lengths):
+    out = []
+    for rollout in _per_rollout(rewards, lengths):
+        ret = sum(gamma ** k * r for k, r in enumerate(rollout))
+        out.extend([ret] * len(rollout))
+    return np.array(out)
+
+
+def test_rollout_terminals():
+    assert np.array_equal(rollout_terminals([1, 3, 1]), [1, 0, 0, 1, 1])
+
+
+@pytest.mark.parametrize('gamma', [0.9, 1.0])
+def test_discounted_cumsum_matches_per_rollout_loop(gamma):
+    rewards = _rewards()
+    terminals = rollout_terminals(LENGTHS)
+    expected = _naive_discounted_cumsum(rewards, gamma, LENGTHS)
+
+    out = discounted_cumsum(rewards, gamma, terminals)
+    assert isinstance(out, np.ndarray)
+    assert np.abs(out - expected).max() < 1e-9
+
+    out = discounted_cumsum(torch.from_numpy(rewards), gamma, terminals)
+    assert torch.is_tensor(out)
+    assert np.abs(out.numpy() - expected).max() < 1e-9
+
+
+@pytest.mark.parametrize('gamma', [0.9, 1.0])
+def test_discounted_return_matches_per_rollout_loop(gamma):
+    rewards = _rewards()
+    terminals = rollout_terminals(LENGTHS)
+    expected = _naive_discounted_return(rewards, gamma, LENGTHS)
+
+    out = discounted_return(rewards, gamma, terminals)
+    assert np.abs(out - expected).max() < 1e-9
+
+    out = discounted_return(torch.from_numpy(rewards), gamma, terminals)
+    assert torch.is_tensor(out)
+    assert np.abs(out.numpy() - expected).max() < 1e-9
+
+
+@pytest.mark.parametrize('to_input', [np.asarray, torch.from_numpy])
+def test_gae_advantages_matches_per_timestep_loop(to_input):
+    gamma, gae_lambda = 0.95, 0.9
+    rng = np.random.RandomState(1)
+    rewards, values, next_values = rng.randn(3, sum(LENGTHS))
+    terminals = rollout_terminals(LENGTHS)
+    # every other rollout terminated; the rest were cut off and bootstrap
+    dones = terminals * (np.cumsum(terminals) % 2)
+
+    expected = np.zeros(len(rewards))
+    advantage = 0.
+    for t in reversed(range(len(rewards))):
+        if terminals[t]:
+            advantage = 0.
+        delta = rewards[t] + gamma * next_values[t] * (1 - dones[t]) - values[t]
+        advantage = expected[t] = delta + gamma * gae_lambda * advantage
+
+    out = gae_advantages(to_input(rewards), to_input(values), to_input(next_values),
+                         to_input(dones), terminals, gamma, gae_lambda)
+    assert np.abs(np.asarray(out) - expected).max() < 1e-9
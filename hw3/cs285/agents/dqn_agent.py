@@ -1,18 +1,28 @@
+import os
+
 import numpy as np
+import torch
 from gym import Env
-from cs285.infrastructure.dqn_utils import MemoryOptimizedReplayBuffer, PiecewiseSchedule
+from cs285.infrastructure.dqn_utils import MemoryOptimizedReplayBuffer, PrioritizedReplayBuffer, LinearSchedule, PiecewiseSchedule
 from cs285.policies.argmax_policy import ArgMaxPolicy
 from cs285.critics.dqn_critic import DQNCritic
+from cs285.infrastructure import pytorch_util as ptu
 
 
 class DQNAgent(object):
     def __init__(self, env, agent_params):
 
-        self.env: Env = env
+        # a list of envs is stepped all together, see step_env
+        if isinstance(env, list):
+            self.envs = env
+        else:
+            self.envs = [env]
+        self.num_envs = len(self.envs)
+        self.env: Env = self.envs[0]
         self.agent_params = agent_params
         self.batch_size = agent_params['batch_size']
         # import ipdb; ipdb.set_trace()
-        self.last_obs = self.env.reset()
+        self.last_obs = self._reset_envs()
 
         self.num_actions = agent_params['ac_dim']
         self.learning_starts = agent_params['learning_starts']
@@ -26,22 +36,118 @@ class DQNAgent(object):
         self.critic = DQNCritic(agent_params, self.optimizer_spec)
         self.actor = ArgMaxPolicy(self.critic)
 
+        self.n_step = agent_params['n_step']
+        # the discounts of the n-step transitions are stashed by sample for
+        # train, like the prioritized replay weights below
+        assert self.n_step == 1 or not agent_params['prefetch_batches'], \
+            'n-step returns do not support prefetching batches'
+
         lander = agent_params['env_name'].startswith('LunarLander')
-        self.replay_buffer = MemoryOptimizedReplayBuffer(
-            agent_params['replay_buffer_size'], agent_params['frame_history_len'], lander=lander)
+        # the transitions of the envs are stored side by side, so the size of
+        # the buffer must be a multiple of their number
+        replay_buffer_size = agent_params['replay_buffer_size']
+        replay_buffer_size -= replay_buffer_size % self.num_envs
+        if agent_params['memmap_replay']:
+            # keep the buffer in memory-mapped files in the run's logdir
+            storage_dir = os.path.join(agent_params['logdir'], 'replay')
+        else:
+            storage_dir = None
+        if agent_params['prioritized_replay']:
+            # the priorities are updated after every sample, so the batches
+            # cannot be sampled ahead of time
+            assert not agent_params['prefetch_batches'], \
+                'prioritized replay does not support prefetching batches'
+            self.replay_buffer = PrioritizedReplayBuffer(
+                replay_buffer_size, agent_params['frame_history_len'],
+                alpha=agent_params['prioritized_replay_alpha'], lander=lander,
+                storage_dir=storage_dir, compress=agent_params['replay_compression'],
+                num_envs=self.num_envs)
+            # anneal the importance sampling correction to full by the end of training
+            self.prioritized_replay_beta = LinearSchedule(
+                agent_params['num_timesteps'], 1.0,
+                initial_p=agent_params['prioritized_replay_beta'])
+        else:
+            self.replay_buffer = MemoryOptimizedReplayBuffer(
+                replay_buffer_size, agent_params['frame_history_len'], lander=lander,
+                storage_dir=storage_dir, compress=agent_params['replay_compression'],
+                num_envs=self.num_envs)
+        # importance weights and indices of the last prioritized sample
+        self.sample_weights = None
+        self.sample_idxes = None
+        # per-transition discounts of the last n-step sample
+        self.sample_discounts = None
         self.t = 0
         self.num_param_updates = 0
 
     def add_to_replay_buffer(self, paths):
         pass
 
+    def save_snapshot(self, path, trainer_state=None):
+        """
+            Save everything needed to resume training (the replay buffer, the
+            networks and optimizer, the step counters and the random states)
+            to the directory path, along with trainer_state, whatever the
+            trainer needs to resume its own loop
+        """
+        self.replay_buffer.save_snapshot(os.path.join(path, 'replay'))
+        state = {
+            't': self.t,
+            'num_param_updates': self.num_param_updates,
+            'q_net': self.critic.q_net.state_dict(),
+            'q_net_target': self.critic.q_net_target.state_dict(),
+            'optimizer': self.critic.optimizer.state_dict(),
+            'learning_rate_scheduler': self.critic.learning_rate_scheduler.state_dict(),
+            'np_random_state': _np_random_state_to_dict(np.random.get_state()),
+            'torch_random_state': torch.get_rng_state(),
+            'trainer_state': trainer_state,
+        }
+        torch.save(state, os.path.join(path, 'agent.pt.tmp'))
+        os.replace(os.path.join(path, 'agent.pt.tmp'), os.path.join(path, 'agent.pt'))
+
+    def load_snapshot(self, path):
+        """
+            Restore the state saved by save_snapshot, and return the
+            trainer_state saved with it (None for older snapshots)
+        """
+        self.replay_buffer.load_snapshot(os.path.join(path, 'replay'))
+        state = torch.load(os.path.join(path, 'agent.pt'), map_location=ptu.device)
+        self.t = state['t']
+        self.num_param_updates = state['num_param_updates']
+        self.critic.q_net.load_state_dict(state['q_net'])
+        self.critic.q_net_target.load_state_dict(state['q_net_target'])
+        self.critic.optimizer.load_state_dict(state['optimizer'])
+        self.critic.learning_rate_scheduler.load_state_dict(state['learning_rate_scheduler'])
+        np.random.set_state(_np_random_state_from_dict(state['np_random_state']))
+        torch.set_rng_state(state['torch_random_state'])
+
+        # the episodes that were running when the snapshot was taken cannot be
+        # continued, so end them at the last stored transition of each env,
+        # which keeps them from being stacked with or bootstrapped from the
+        # new episodes
+        if self.replay_buffer.num_in_buffer > 0:
+            last_idxes = self.replay_buffer.next_idx - 1 - np.arange(self.num_envs)
+            self.replay_buffer.done[last_idxes % self.replay_buffer.size] = True
+        self.last_obs = self._reset_envs()
+        return state.get('trainer_state')
+
+    def _reset_envs(self):
+        # the first observation of every env, or of the only one
+        if self.num_envs > 1:
+            return [env.reset() for env in self.envs]
+        return self.env.reset()
+
     def step_env(self):
         """
             Step the env and store the transition
             At the end of this block of code, the simulator should have been
             advanced one step, and the replay buffer should contain one more transition.
             Note that self.last_obs must always point to the new latest observation.
+
+            With several envs, each of them is advanced one step instead, see
+            _step_envs.
         """
+        if self.num_envs > 1:
+            return self._step_envs()
 
         # TODO store the latest observation ("frame") into the replay buffer
         # HINT: the replay buffer used here is `MemoryOptimizedReplayBuffer`
@@ -85,9 +191,49 @@ class DQNAgent(object):
 
         self.last_obs = obs
 
-    def sample(self, batch_size):
+    def _step_envs(self):
+        """
+            step_env for several envs: advance every env one step, with the
+            greedy actions of all of them from one batched forward pass, and
+            store all the transitions in the replay buffer
+        """
+        self.replay_buffer_idx = self.replay_buffer.store_frames(self.last_obs)
+
+        eps = self.exploration.value(self.t)
+        perform_random_action = (np.random.rand(self.num_envs) < eps) | (
+            self.t < self.learning_starts)
+        if perform_random_action.all():
+            actions = np.array([env.action_space.sample() for env in self.envs])
+        else:
+            observations = self.replay_buffer.encode_recent_observations()
+            actions = np.array(self.actor.get_action(observations))
+            for i in np.nonzero(perform_random_action)[0]:
+                actions[i] = self.envs[i].action_space.sample()
+
+        rewards = np.empty(self.num_envs, dtype=np.float32)
+        dones = np.empty(self.num_envs, dtype=bool)
+        for i, env in enumerate(self.envs):
+            obs, rewards[i], dones[i], _ = env.step(actions[i])
+            if dones[i]:
+                obs = env.reset()
+            self.last_obs[i] = obs
+
+        self.replay_buffer.store_effects(
+            self.replay_buffer_idx, actions, rewards, dones)
+
+    def sample(self, batch_size, rng=None):
+        # rng: a np.random.Generator to sample with instead of the global
+        # numpy random state, as the BatchPrefetcher does
         if self.replay_buffer.can_sample(self.batch_size):
-            return self.replay_buffer.sample(batch_size)
+            n_step_kwargs = dict(n_step=self.n_step, gamma=self.agent_params['gamma'])
+            if isinstance(self.replay_buffer, PrioritizedReplayBuffer):
+                *batch, self.sample_weights, self.sample_idxes = self.replay_buffer.sample(
+                    batch_size, beta=self.prioritized_replay_beta.value(self.t), **n_step_kwargs)
+            else:
+                batch = self.replay_buffer.sample(batch_size, rng=rng, **n_step_kwargs)
+            if self.n_step > 1:
+                *batch, self.sample_discounts = batch
+            return batch
         else:
             return [], [], [], [], []
 
@@ -104,8 +250,13 @@ class DQNAgent(object):
                 ac_na,
                 next_ob_no,
                 re_n,
-                terminal_n
+                terminal_n,
+                weights=self.sample_weights,
+                discount_n=self.sample_discounts,
             )
+            td_errors = log.pop('TD Errors')
+            if self.sample_idxes is not None:
+                self.replay_buffer.update_priorities(self.sample_idxes, td_errors)
 
             # TODO update the target network periodically
             # HINT: your critic already has this functionality implemented
@@ -116,3 +267,16 @@ class DQNAgent(object):
 
         self.t += 1
         return log
+
+
+# np.random's state as tensors and numbers only, so that torch.load can read it
+# back without unpickling numpy objects
+def _np_random_state_to_dict(np_random_state):
+    name, keys, pos, has_gauss, cached_gaussian = np_random_state
+    return {'keys': torch.from_numpy(keys.astype(np.int64)), 'pos': pos,
+            'has_gauss': has_gauss, 'cached_gaussian': cached_gaussian}
+
+
+def _np_random_state_from_dict(state):
+    return ('MT19937', state['keys'].numpy().astype(np.uint32), state['pos'],
+            state['has_gauss'], state['cached_gaussian'])
@@ -4,7 +4,7 @@ import torch
 
 from cs285.critics.bootstrapped_continuous_critic import \
     BootstrappedContinuousCritic
-from cs285.infrastructure.replay_buffer import ReplayBuffer
+from cs285.infrastructure.replay_buffer import ReplayBuffer, TorchReplayBuffer
 from cs285.infrastructure.utils import *
 from cs285.policies.MLP_policy import MLPPolicyAC
 from .base_agent import BaseAgent
@@ -47,7 +47,11 @@ class SACAgent(BaseAgent):
         self.critic_target.load_state_dict(self.critic.state_dict())
 
         self.training_step = 0
-        self.replay_buffer = ReplayBuffer(max_size=100000)
+        if self.agent_params['torch_replay']:
+            # sample batches as tensors already on the device
+            self.replay_buffer = TorchReplayBuffer(max_size=100000)
+        else:
+            self.replay_buffer = ReplayBuffer(max_size=100000)
 
     def update_critic(self, ob_no, ac_na, next_ob_no, re_n, terminal_n):
         # TODO:
@@ -85,13 +89,26 @@ class SACAgent(BaseAgent):
 
     def train(self, ob_no, ac_na, re_n, next_ob_no, terminal_n):
 
+        # the batch is either numpy arrays from sample, or tensors already on
+        # ptu.device from a TorchReplayBuffer or a BatchPrefetcher
+        if isinstance(ob_no, np.ndarray):
+            ob_no = ptu.from_numpy(ob_no)
+        if isinstance(ac_na, np.ndarray):
+            ac_na = ptu.from_numpy(ac_na)
+        if isinstance(re_n, np.ndarray):
+            re_n = ptu.from_numpy(re_n)
+        if isinstance(next_ob_no, np.ndarray):
+            next_ob_no = ptu.from_numpy(next_ob_no)
+        if isinstance(terminal_n, np.ndarray):
+            terminal_n = ptu.from_numpy(terminal_n)
+
         # for agent_params['num_critic_updates_per_agent_update'] steps,
 
         # Accumulate loss
         critic_loss = 0.
         for i in range(self.agent_params['num_critic_updates_per_agent_update']):
-            critic_loss += self.update_critic(ob_no=ptu.from_numpy(ob_no), ac_na=ptu.from_numpy(ac_na), re_n=ptu.from_numpy(
-                re_n), next_ob_no=ptu.from_numpy(next_ob_no), terminal_n=ptu.from_numpy(terminal_n))
+            critic_loss += self.update_critic(ob_no=ob_no, ac_na=ac_na, re_n=re_n,
+                                              next_ob_no=next_ob_no, terminal_n=terminal_n)
         # average
         critic_loss = critic_loss/(i+1)
 
@@ -109,7 +126,7 @@ class SACAgent(BaseAgent):
         if self.training_step % self.actor_update_frequency == 0:
             for i in range(self.agent_params['num_actor_updates_per_agent_update']):
                 act_l_t, alp_l_t, alpha = self.actor.update(
-                    ptu.from_numpy(ob_no), self.critic)
+                    ob_no, self.critic)
                 actor_l += act_l_t
                 alpha_l += alp_l_t
 
@@ -129,5 +146,5 @@ class SACAgent(BaseAgent):
     def add_to_replay_buffer(self, paths):
         self.replay_buffer.add_rollouts(paths)
 
-    def sample(self, batch_size):
-        return self.replay_buffer.sample_random_data(batch_size)
+    def sample(self, batch_size, rng=None):
+        return self.replay_buffer.sample_random_data(batch_size, rng=rng)
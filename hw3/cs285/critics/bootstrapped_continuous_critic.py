@@ -1,6 +1,7 @@
 from .base_critic import BaseCritic
 from torch import nn
 from torch import optim
+import numpy as np
 
 from cs285.infrastructure import pytorch_util as ptu
 
@@ -72,7 +73,18 @@ class BootstrappedContinuousCritic(nn.Module, BaseCritic):
 
             returns:
                 training loss
+
+            all of them can be numpy arrays or tensors already on ptu.device
         """
+        if isinstance(ob_no, np.ndarray):
+            ob_no = ptu.from_numpy(ob_no)
+        if isinstance(next_ob_no, np.ndarray):
+            next_ob_no = ptu.from_numpy(next_ob_no)
+        if isinstance(reward_n, np.ndarray):
+            reward_n = ptu.from_numpy(reward_n)
+        if isinstance(terminal_n, np.ndarray):
+            terminal_n = ptu.from_numpy(terminal_n)
+
         # TODO: Implement the pseudocode below: do the following (
         # self.num_grad_steps_per_target_update * self.num_target_updates)
         # times:
@@ -90,11 +102,11 @@ class BootstrappedContinuousCritic(nn.Module, BaseCritic):
         updates = 0
         while updates < self.num_grad_steps_per_target_update*self.num_target_updates:
             if updates % self.num_grad_steps_per_target_update == 0:
-                V_s_prime = self(ptu.from_numpy(next_ob_no)).detach()
-                target = (ptu.from_numpy(reward_n) + (self.gamma *
-                          V_s_prime)*(1.0 - ptu.from_numpy(terminal_n)))
+                V_s_prime = self(next_ob_no).detach()
+                target = (reward_n + (self.gamma *
+                          V_s_prime)*(1.0 - terminal_n))
             self.optimizer.zero_grad()
-            pred = self(ptu.from_numpy(ob_no))
+            pred = self(ob_no)
             loss = self.loss(pred, target)
             loss.backward()
             self.optimizer.step()
@@ -0,0 +1,89 @@
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from cs285.infrastructure import pytorch_util as ptu
+
+
+class BatchPrefetcher(object):
+    """
+        Samples and converts training batches in a background thread, so that
+        the next batches are ready while the current gradient step runs.
+
+        Each batch returned by sample_fn(batch_size, rng=rng) is turned into float
+        tensors on the CPU (in pinned memory if pin_memory is set and the
+        learner is on a GPU), and up to queue_size of them are kept ready.
+        Iterating over the prefetcher yields num_batches batches, moved to
+        ptu.device.
+
+        Use it as a context manager (or call close) so that the thread stops
+        even if the batches are not all consumed.
+
+        The buffer sampled from must not change while batches are prefetched.
+        The batches are drawn from rng, a np.random.Generator that only this
+        thread uses, so that seeded runs do not depend on how the thread's
+        draws interleave with those of the main thread from the global numpy
+        random state.
+    """
+
+    def __init__(self, sample_fn, batch_size, num_batches, rng, queue_size=2, pin_memory=False):
+        self.num_batches = num_batches
+        self.rng = rng
+        self.pin_memory = pin_memory and ptu.device.type == 'cuda'
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._worker, args=(sample_fn, batch_size), daemon=True)
+        self.thread.start()
+
+    def _worker(self, sample_fn, batch_size):
+        try:
+            for _ in range(self.num_batches):
+                batch = [self._to_tensor(x) for x in sample_fn(batch_size, rng=self.rng)]
+                if not self._put(batch):
+                    return
+        except Exception as e:
+            # re-raised in the consumer
+            self._put(e)
+
+    def _put(self, item):
+        # wait for room in the queue, unless the prefetcher is closed first;
+        # returns whether the item was queued
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _to_tensor(self, x):
+        # empty batches (nothing to sample yet) are passed through as they are
+        if not isinstance(x, np.ndarray):
+            return x
+        tensor = torch.from_numpy(x).float()
+        if self.pin_memory:
+            tensor = tensor.pin_memory()
+        return tensor
+
+    def __iter__(self):
+        for _ in range(self.num_batches):
+            batch = self.queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+            yield [x.to(ptu.device, non_blocking=self.pin_memory)
+                   if isinstance(x, torch.Tensor) else x for x in batch]
+        self.thread.join()
+
+    def close(self):
+        # stop the worker, also if the batches were not all consumed
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
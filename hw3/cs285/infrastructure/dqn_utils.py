@@ -1,7 +1,12 @@
 """This file includes a collection of utility functions that are useful for
 implementing DQN."""
+import json
+import os
 import random
-from collections import namedtuple
+import shutil
+import zlib
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import gym
 import numpy as np
@@ -11,6 +16,11 @@ import torch.optim as optim
 from cs285.infrastructure.atari_wrappers import wrap_deepmind
 from gym.envs.registration import register
 
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 import torch
 
 
@@ -189,6 +199,32 @@ def sample_n_unique(sampling_f, n):
     return res
 
 
+def sample_n_unique_indices(n, num_candidates, replace=False, rng=None):
+    """Sample n integers from [0, num_candidates) with numpy, without
+    replacement unless `replace` is set. Drawn from the np.random.Generator
+    `rng` if given, and from the global numpy random state otherwise.
+    """
+    if rng is None:
+        randint, permutation = np.random.randint, np.random.permutation
+    else:
+        randint, permutation = rng.integers, rng.permutation
+    if replace:
+        return randint(num_candidates, size=n)
+    assert n <= num_candidates
+    # when most candidates are needed anyway, a permutation is cheapest
+    if 4 * n >= num_candidates:
+        return permutation(num_candidates)[:n]
+    # otherwise draw with replacement, drop duplicates and top up; with at
+    # most a quarter of the candidates needed this rarely takes more than
+    # a couple of rounds
+    res = np.unique(randint(num_candidates, size=n))
+    while len(res) < n:
+        extra = randint(num_candidates, size=n - len(res))
+        res = np.unique(np.concatenate([res, extra]))
+    # np.unique sorts, so shuffle to not correlate position with age
+    return permutation(res)
+
+
 class Schedule(object):
     def value(self, t):
         """Value of the schedule at time t"""
@@ -336,8 +372,91 @@ def get_wrapper_by_name(env, classname):
         else:
             raise ValueError("Couldn't find wrapper named %s"%classname)
 
+class CompressedFrameStore(object):
+    def __init__(self, size, frame_shape, dtype, codec='zlib', cache_size=1024):
+        """Array-like store of `size` frames, each kept as its own compressed
+        bytes string, for MemoryOptimizedReplayBuffer's compressed mode.
+
+        Indexing with an int, a slice or an array of indices decodes the
+        frames (in one batch, decoding every distinct frame once) and returns
+        them as an array, as indexing the uncompressed array would. The last
+        `cache_size` decoded frames are kept in an LRU cache, since
+        neighbouring frame stacks share most of their frames. Frames that
+        were never stored read as zeros.
+
+        Parameters
+        ----------
+        size: int
+            Number of frames.
+        frame_shape: tuple
+            Shape of a single frame.
+        dtype: np.dtype
+            Type of the frames.
+        codec: str
+            'zlib', or 'lz4' if the lz4 package is installed.
+        cache_size: int
+            Number of decoded frames to keep.
+        """
+        self.shape = (size,) + tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        if codec == 'zlib':
+            # the fastest level already gets most of the gain on Atari frames
+            self._compress = lambda data: zlib.compress(data, 1)
+            self._decompress = zlib.decompress
+        elif codec == 'lz4':
+            if lz4 is None:
+                raise ImportError("the 'lz4' codec needs the lz4 package (pip install lz4)")
+            self._compress = lz4.frame.compress
+            self._decompress = lz4.frame.decompress
+        else:
+            raise ValueError("Unknown codec %s" % codec)
+        self._frames = [None] * size
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """Bytes taken by the compressed frames."""
+        return sum(len(frame) for frame in self._frames if frame is not None)
+
+    def _indices(self, idxes):
+        if isinstance(idxes, slice):
+            return np.arange(*idxes.indices(len(self)))
+        return np.asarray(idxes)
+
+    def __setitem__(self, idxes, frames):
+        idxes = self._indices(idxes)
+        frames = np.asarray(frames, dtype=self.dtype).reshape(idxes.shape + self.shape[1:])
+        for idx, frame in zip(idxes.reshape(-1), frames.reshape((-1,) + self.shape[1:])):
+            self._frames[idx] = self._compress(np.ascontiguousarray(frame).tobytes())
+            self._cache.pop(idx, None)
+
+    def __getitem__(self, idxes):
+        idxes = self._indices(idxes)
+        unique_idxes, inverse = np.unique(idxes, return_inverse=True)
+        decoded = np.stack([self._decode(idx) for idx in unique_idxes])
+        return decoded[inverse].reshape(idxes.shape + self.shape[1:])
+
+    def _decode(self, idx):
+        frame = self._cache.get(idx)
+        if frame is not None:
+            self._cache.move_to_end(idx)
+            return frame
+        if self._frames[idx] is None:
+            return np.zeros(self.shape[1:], dtype=self.dtype)
+        frame = np.frombuffer(self._decompress(self._frames[idx]), dtype=self.dtype).reshape(self.shape[1:])
+        self._cache[idx] = frame
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return frame
+
+
 class MemoryOptimizedReplayBuffer(object):
-    def __init__(self, size, frame_history_len, lander=False):
+    def __init__(self, size, frame_history_len, lander=False, storage_dir=None,
+                 compress=None, num_envs=1):
         """This is a memory efficient implementation of the replay buffer.
 
         The sepecific memory optimizations use here are:
@@ -362,11 +481,34 @@ class MemoryOptimizedReplayBuffer(object):
             overflows the old memories are dropped.
         frame_history_len: int
             Number of memories to be retried for each observation.
+        storage_dir: str or None
+            If given, the buffer's arrays are kept in .npy files in this
+            directory and memory-mapped, instead of living in RAM. Call
+            `flush` to make the files a complete snapshot of the buffer,
+            which `MemoryOptimizedReplayBuffer.load` can open again later.
+        compress: str or None
+            If given ('zlib' or 'lz4'), every frame is stored compressed on its
+            own in a CompressedFrameStore, and decompressed when sampled. Atari
+            frames shrink several times; this cannot be combined with
+            `storage_dir`.
+        num_envs: int
+            Number of envs whose transitions are stored side by side, one
+            frame of each at a time (see `store_frames`). The transitions of
+            every env are then `num_envs` indices apart, and `size` must be a
+            multiple of `num_envs`.
         """
         self.lander = lander
+        self.storage_dir = storage_dir
+        if storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+        assert compress is None or storage_dir is None, \
+            'compressed frames cannot be memory-mapped'
+        self.compress = compress
 
         self.size = size
         self.frame_history_len = frame_history_len
+        assert size % num_envs == 0, 'size must be a multiple of num_envs'
+        self.num_envs = num_envs
 
         self.next_idx      = 0
         self.num_in_buffer = 0
@@ -378,20 +520,49 @@ class MemoryOptimizedReplayBuffer(object):
 
     def can_sample(self, batch_size):
         """Returns true if `batch_size` different transitions can be sampled from the buffer."""
-        return batch_size + 1 <= self.num_in_buffer
+        return batch_size + self.num_envs <= self.num_in_buffer
 
-    def _encode_sample(self, idxes):
-        obs_batch      = np.concatenate([self._encode_observation(idx)[None] for idx in idxes], 0)
+    def _encode_sample(self, idxes, n_step=1, gamma=1.0):
+        idxes          = np.asarray(idxes)
+        if n_step > 1:
+            return self._encode_n_step_sample(idxes, n_step, gamma)
+        obs_batch      = self._encode_observations(idxes)
         act_batch      = self.action[idxes]
         rew_batch      = self.reward[idxes]
-        next_obs_batch = np.concatenate([self._encode_observation(idx + 1)[None] for idx in idxes], 0)
-        done_mask      = np.array([1.0 if self.done[idx] else 0.0 for idx in idxes], dtype=np.float32)
+        next_obs_batch = self._encode_observations((idxes + self.num_envs) % self.size)
+        done_mask      = self.done[idxes].astype(np.float32)
 
         return obs_batch, act_batch, rew_batch, next_obs_batch, done_mask
 
+    def _encode_n_step_sample(self, idxes, n_step, gamma):
+        # (batch_size, n_step) positions of the transitions that make up each
+        # n-step transition, num_envs apart
+        offsets   = np.arange(n_step)
+        positions = (idxes[:, None] + offsets * self.num_envs) % self.size
+        # a transition only counts if its effect has been stored, i.e. if it
+        # is not past the newest transition of its env ...
+        oldest_idx    = self.next_idx if self.num_in_buffer == self.size else 0
+        num_available = (self.num_in_buffer - 1 - (idxes - oldest_idx) % self.size) // self.num_envs
+        taken         = offsets < num_available[:, None]
+        # ... and if no episode ended at one of the transitions before it
+        dones = self.done[positions]
+        taken[:, 1:] &= ~np.logical_or.accumulate(dones[:, :-1], axis=1)
+
+        num_steps      = taken.sum(axis=1)
+        obs_batch      = self._encode_observations(idxes)
+        act_batch      = self.action[idxes]
+        # masked before weighting, as the slots not taken may never have been written
+        rew_batch      = (np.where(taken, self.reward[positions], 0.) * gamma ** offsets).sum(axis=1).astype(np.float32)
+        next_obs_batch = self._encode_observations((idxes + num_steps * self.num_envs) % self.size)
+        done_mask      = (dones & taken).any(axis=1).astype(np.float32)
+        discount_batch = (gamma ** num_steps).astype(np.float32)
 
-    def sample(self, batch_size):
-        """Sample `batch_size` different transitions.
+        return obs_batch, act_batch, rew_batch, next_obs_batch, done_mask, discount_batch
+
+
+    def sample(self, batch_size, replace=False, n_step=1, gamma=1.0, rng=None):
+        """Sample `batch_size` different transitions (or, with `replace`,
+        `batch_size` transitions that may repeat).
 
         i-th sample transition is the following:
 
@@ -405,6 +576,20 @@ class MemoryOptimizedReplayBuffer(object):
         ----------
         batch_size: int
             How many transitions to sample.
+        replace: bool
+            Whether the same transition can be sampled more than once.
+        n_step: int
+            If larger than 1, sample n-step transitions instead: `rew_batch[i]`
+            is then the discounted sum of the rewards of the next `n_step`
+            transitions, `next_obs_batch[i]` the observation after them, and
+            `done_mask[i]` is 1 if the episode ended within them. Fewer steps
+            are taken if the episode ends, or the buffer runs out of stored
+            transitions, before that.
+        gamma: float
+            Discount for the rewards of n-step transitions.
+        rng: np.random.Generator or None
+            Where to draw the transitions from, instead of the global numpy
+            random state.
 
         Returns
         -------
@@ -422,10 +607,23 @@ class MemoryOptimizedReplayBuffer(object):
             and dtype np.uint8
         done_mask: np.array
             Array of shape (batch_size,) and dtype np.float32
+        discount_batch: np.array
+            Only returned if `n_step` is larger than 1. Array of shape
+            (batch_size,) and dtype np.float32, gamma to the power of the
+            number of steps taken, to discount the value of `next_obs_batch[i]` by
         """
-        assert self.can_sample(batch_size)
-        idxes = sample_n_unique(lambda: random.randint(0, self.num_in_buffer - 2), batch_size)
-        return self._encode_sample(idxes)
+        assert replace or self.can_sample(batch_size)
+        idxes = self._sample_indices(batch_size, replace, rng)
+        return self._encode_sample(idxes, n_step, gamma)
+
+    def _sample_indices(self, batch_size, replace=False, rng=None):
+        # every stored transition except the newest one of each env, whose
+        # next frame has not been stored yet; counted from the oldest frame,
+        # which sits at next_idx once the buffer has wrapped around
+        num_candidates = self.num_in_buffer - self.num_envs
+        oldest_idx = self.next_idx if self.num_in_buffer == self.size else 0
+        offsets = sample_n_unique_indices(batch_size, num_candidates, replace, rng)
+        return (oldest_idx + offsets) % self.size
 
     def encode_recent_observation(self):
         """Return the most recent `frame_history_len` frames.
@@ -440,31 +638,51 @@ class MemoryOptimizedReplayBuffer(object):
         assert self.num_in_buffer > 0
         return self._encode_observation((self.next_idx - 1) % self.size)
 
+    def encode_recent_observations(self):
+        """Return the most recent `frame_history_len` frames of each env.
+
+        Returns
+        -------
+        observations: np.array
+            Array of shape (num_envs, img_h, img_w, img_c * frame_history_len)
+            and dtype np.uint8, where observations[i] is the
+            `encode_recent_observation` of the i-th env
+        """
+        assert self.num_in_buffer > 0
+        idxes = self.next_idx - self.num_envs + np.arange(self.num_envs)
+        return self._encode_observations(idxes % self.size)
+
     def _encode_observation(self, idx):
-        end_idx   = idx + 1 # make noninclusive
-        start_idx = end_idx - self.frame_history_len
+        return self._encode_observations(np.array([idx]))[0]
+
+    def _encode_observations(self, idxes):
+        """Stack the last `frame_history_len` frames for every index in `idxes` at once.
+
+        Frames from before the start of the buffer (while it is not full yet), or
+        from before the last episode boundary, are replaced by zeros, exactly as
+        if the observations had been encoded one at a time.
+        """
         # this checks if we are using low-dimensional observations, such as RAM
         # state, in which case we just directly return the latest RAM.
         if len(self.obs.shape) == 2:
-            return self.obs[end_idx-1]
+            return self.obs[idxes]
+        # (batch_size, frame_history_len) positions of the frames to stack,
+        # oldest first and num_envs apart; they can be negative and wrap
+        # around the buffer
+        offsets = np.arange(1 - self.frame_history_len, 1) * self.num_envs
+        positions = idxes[:, None] + offsets[None, :]
+        wrapped = positions % self.size
         # if there weren't enough frames ever in the buffer for context
-        if start_idx < 0 and self.num_in_buffer != self.size:
-            start_idx = 0
-        for idx in range(start_idx, end_idx - 1):
-            if self.done[idx % self.size]:
-                start_idx = idx + 1
-        missing_context = self.frame_history_len - (end_idx - start_idx)
-        # if zero padding is needed for missing context
-        # or we are on the boundry of the buffer
-        if start_idx < 0 or missing_context > 0:
-            frames = [np.zeros_like(self.obs[0]) for _ in range(missing_context)]
-            for idx in range(start_idx, end_idx):
-                frames.append(self.obs[idx % self.size])
-            return np.concatenate(frames, 2)
-        else:
-            # this optimization has potential to saves about 30% compute time \o/
-            img_h, img_w = self.obs.shape[1], self.obs.shape[2]
-            return self.obs[start_idx:end_idx].transpose(1, 2, 0, 3).reshape(img_h, img_w, -1)
+        valid = (positions >= 0) | (self.num_in_buffer == self.size)
+        # a frame is cut off when its episode ended at or after it, before idx
+        dones = self.done[wrapped[:, :-1]]
+        cut_off = np.logical_or.accumulate(dones[:, ::-1], axis=1)[:, ::-1]
+        valid[:, :-1] &= ~cut_off
+        # one gather for the whole batch, then zero padding for missing context
+        frames = self.obs[wrapped]
+        frames[~valid] = 0
+        batch_size, _, img_h, img_w, _ = frames.shape
+        return frames.transpose(0, 2, 3, 1, 4).reshape(batch_size, img_h, img_w, -1)
 
     def store_frame(self, frame):
         """Store a single frame in the buffer at the next available index, overwriting
@@ -482,10 +700,7 @@ class MemoryOptimizedReplayBuffer(object):
             Index at which the frame is stored. To be used for `store_effect` later.
         """
         if self.obs is None:
-            self.obs      = np.empty([self.size] + list(frame.shape), dtype=np.float32 if self.lander else np.uint8)
-            self.action   = np.empty([self.size],                     dtype=np.int32)
-            self.reward   = np.empty([self.size],                     dtype=np.float32)
-            self.done     = np.empty([self.size],                     dtype=np.bool)
+            self._allocate_storage(frame.shape)
         self.obs[self.next_idx] = frame
 
         ret = self.next_idx
@@ -515,3 +730,363 @@ class MemoryOptimizedReplayBuffer(object):
         self.reward[idx] = reward
         self.done[idx]   = done
 
+    def store_frames(self, frames):
+        """Store the latest frame of each of the `num_envs` envs, in order.
+
+        Returns
+        -------
+        idxes: np.array
+            Indices at which the frames are stored. To be used for
+            `store_effects` later.
+        """
+        assert len(frames) == self.num_envs
+        return np.array([self.store_frame(frame) for frame in frames])
+
+    def store_effects(self, idxes, actions, rewards, dones):
+        """`store_effect` for all the frames stored by `store_frames` at once."""
+        self.action[idxes] = actions
+        self.reward[idxes] = rewards
+        self.done[idxes]   = dones
+
+    def _allocate_storage(self, frame_shape):
+        obs_dtype     = np.float32 if self.lander else np.uint8
+        if self.compress is not None:
+            self.obs  = CompressedFrameStore(self.size, frame_shape, obs_dtype, codec=self.compress)
+        else:
+            self.obs  = self._allocate('obs', [self.size] + list(frame_shape), obs_dtype)
+        self.action   = self._allocate('action', [self.size],                     np.int32)
+        self.reward   = self._allocate('reward', [self.size],                     np.float32)
+        self.done     = self._allocate('done',   [self.size],                     bool)
+
+    def _allocate(self, name, shape, dtype):
+        if self.storage_dir is None:
+            return np.empty(shape, dtype=dtype)
+        return np.lib.format.open_memmap(
+            os.path.join(self.storage_dir, name + '.npy'), mode='w+', dtype=dtype, shape=tuple(shape))
+
+    def flush(self):
+        """Write the memory-mapped arrays and the buffer's position to `storage_dir`.
+        Does nothing for a buffer kept in RAM."""
+        if self.storage_dir is None or self.obs is None:
+            return
+        for array in (self.obs, self.action, self.reward, self.done):
+            array.flush()
+        meta = {
+            'size': self.size,
+            'frame_history_len': self.frame_history_len,
+            'lander': self.lander,
+            'num_envs': self.num_envs,
+            'next_idx': self.next_idx,
+            'num_in_buffer': self.num_in_buffer,
+            'init_kwargs': self._init_kwargs(),
+        }
+        # written last and atomically, so that it only ever describes flushed arrays
+        meta_path = os.path.join(self.storage_dir, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    @classmethod
+    def load(cls, storage_dir):
+        """Open a buffer previously flushed to `storage_dir`. Its arrays stay
+        memory-mapped, and new frames are written back to the same files."""
+        with open(os.path.join(storage_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        buffer = cls(meta['size'], meta['frame_history_len'],
+                     lander=meta['lander'], storage_dir=storage_dir,
+                     num_envs=meta.get('num_envs', 1), **meta.get('init_kwargs', {}))
+        buffer.obs    = np.load(os.path.join(storage_dir, 'obs.npy'),    mmap_mode='r+')
+        buffer.action = np.load(os.path.join(storage_dir, 'action.npy'), mmap_mode='r+')
+        buffer.reward = np.load(os.path.join(storage_dir, 'reward.npy'), mmap_mode='r+')
+        buffer.done   = np.load(os.path.join(storage_dir, 'done.npy'),   mmap_mode='r+')
+        buffer.next_idx = meta['next_idx']
+        buffer.num_in_buffer = meta['num_in_buffer']
+        buffer._on_load()
+        return buffer
+
+    def _init_kwargs(self):
+        """Hook for subclasses to name the constructor arguments of their own
+        that `load` has to pass again, as a JSON-serializable dict."""
+        return {}
+
+    def _on_load(self):
+        """Hook for subclasses to rebuild state that is not stored on disk."""
+        pass
+
+    def save_snapshot(self, path, chunk_size=10000):
+        """Save the stored transitions and the buffer's position to the directory
+        `path`, as compressed .npz chunks of `chunk_size` transitions each.
+
+        The snapshot is written next to `path` first and then moved in its place,
+        so an interrupted save leaves the previous snapshot intact, either at
+        `path` or, if it stopped in the middle of the swap, at `path + '.old'`,
+        where `load_snapshot` looks for it.
+        """
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        num_chunks = 0
+        for start in range(0, self.num_in_buffer, chunk_size):
+            end = min(start + chunk_size, self.num_in_buffer)
+            np.savez_compressed(
+                os.path.join(tmp_path, 'chunk_%05d.npz' % num_chunks),
+                obs=self.obs[start:end], action=self.action[start:end],
+                reward=self.reward[start:end], done=self.done[start:end])
+            num_chunks += 1
+
+        meta = {
+            'size': self.size,
+            'frame_history_len': self.frame_history_len,
+            'frame_shape': None if self.obs is None else list(self.obs.shape[1:]),
+            'num_envs': self.num_envs,
+            'next_idx': self.next_idx,
+            'num_in_buffer': self.num_in_buffer,
+            'chunk_size': chunk_size,
+            'num_chunks': num_chunks,
+        }
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        old_path = path + '.old'
+        if os.path.exists(path):
+            # a leftover .old is stale when path is complete
+            if os.path.exists(old_path):
+                shutil.rmtree(old_path)
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+
+    def load_snapshot(self, path, num_threads=4):
+        """Restore the transitions saved by `save_snapshot` into this buffer,
+        which must have the same size and frame_history_len. The chunks are
+        decompressed by `num_threads` threads in parallel.
+        """
+        if not os.path.exists(path) and os.path.exists(path + '.old'):
+            # a save was interrupted between moving the previous snapshot
+            # aside and moving the new one in place
+            path = path + '.old'
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        assert meta['size'] == self.size, 'snapshot is for a buffer of size %d' % meta['size']
+        assert meta['frame_history_len'] == self.frame_history_len
+        assert meta.get('num_envs', 1) == self.num_envs
+
+        if meta['frame_shape'] is not None and self.obs is None:
+            self._allocate_storage(meta['frame_shape'])
+
+        def load_chunk(chunk_idx):
+            start = chunk_idx * meta['chunk_size']
+            with np.load(os.path.join(path, 'chunk_%05d.npz' % chunk_idx)) as chunk:
+                end = start + len(chunk['done'])
+                self.obs[start:end] = chunk['obs']
+                self.action[start:end] = chunk['action']
+                self.reward[start:end] = chunk['reward']
+                self.done[start:end] = chunk['done']
+
+        with ThreadPoolExecutor(num_threads) as pool:
+            # list() to re-raise any error from the threads
+            list(pool.map(load_chunk, range(meta['num_chunks'])))
+
+        self.next_idx = meta['next_idx']
+        self.num_in_buffer = meta['num_in_buffer']
+        self._on_load()
+
+
+class SegmentTree(object):
+    def __init__(self, capacity, operation, neutral_element):
+        """Array-backed segment tree over `capacity` values.
+
+        Node 1 is the root, the children of node i are nodes 2i and 2i + 1, and
+        value j is stored in leaf `capacity + j`, so the tree is a flat array of
+        length 2 * capacity and every path from the root to a leaf has the same
+        length.
+
+        Parameters
+        ----------
+        capacity: int
+            Number of values; must be a power of two.
+        operation: np.ufunc
+            Associative operation used to combine two children (np.add, np.minimum).
+        neutral_element: float
+            Value of an empty leaf, e.g. 0 for np.add and inf for np.minimum.
+        """
+        assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be a power of 2."
+        self.capacity = capacity
+        self._operation = operation
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
+
+    def __getitem__(self, idxes):
+        return self._value[np.asarray(idxes) + self.capacity]
+
+    def __setitem__(self, idxes, values):
+        """Set the leaves at `idxes` and recompute their ancestors, one level
+        of the tree at a time, in O(len(idxes) * log(capacity))."""
+        nodes = np.asarray(idxes) + self.capacity
+        self._value[nodes] = values
+        nodes = np.unique(nodes) // 2
+        # all leaves are at the same depth, so the whole batch reaches the
+        # root (node 1) at the same time
+        while len(nodes) > 0 and nodes[0] >= 1:
+            self._value[nodes] = self._operation(
+                self._value[2 * nodes], self._value[2 * nodes + 1])
+            nodes = np.unique(nodes // 2)
+
+    def reduce(self):
+        """Result of the operation over all the values."""
+        return self._value[1]
+
+
+class SumSegmentTree(SegmentTree):
+    def __init__(self, capacity):
+        super(SumSegmentTree, self).__init__(capacity, np.add, 0.0)
+
+    def sum(self):
+        return self.reduce()
+
+    def find_prefixsum_idx(self, prefixsums):
+        """For every prefixsum, find the index i such that
+        value[0] + ... + value[i - 1] <= prefixsum < value[0] + ... + value[i],
+        by descending from the root for the whole batch at once.
+
+        The prefixsums are clamped to [0, sum()), and the descent never enters
+        a subtree whose sum is 0, so as long as sum() > 0 every index returned
+        has a positive value, however the rounding of the sums turns out.
+        """
+        prefixsums = np.clip(np.array(prefixsums, dtype=np.float64),
+                             0, self.sum() * (1 - 1e-12))
+        nodes = np.ones(len(prefixsums), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            left_sums = self._value[left]
+            right_sums = self._value[left + 1]
+            go_right = (right_sums > 0) & ((prefixsums > left_sums) | (left_sums <= 0))
+            prefixsums -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.capacity
+
+
+class MinSegmentTree(SegmentTree):
+    def __init__(self, capacity):
+        super(MinSegmentTree, self).__init__(capacity, np.minimum, float('inf'))
+
+    def min(self):
+        return self.reduce()
+
+
+class PrioritizedReplayBuffer(MemoryOptimizedReplayBuffer):
+    def __init__(self, size, frame_history_len, alpha=0.6, eps=1e-6, lander=False, storage_dir=None,
+                 compress=None, num_envs=1):
+        """Prioritized version of MemoryOptimizedReplayBuffer
+        (https://arxiv.org/abs/1511.05952).
+
+        Transition i is sampled with probability proportional to p_i ** alpha,
+        where p_i is the absolute TD error it had the last time it was trained on
+        (plus `eps`), or the largest priority seen so far if it is new. The sum
+        and min over the priorities are kept in segment trees, so that storing,
+        sampling and updating a batch are all O(batch_size * log(size)).
+
+        Parameters
+        ----------
+        size: int
+            Max number of transitions to store in the buffer.
+        frame_history_len: int
+            Number of memories to be retried for each observation.
+        alpha: float
+            How much prioritization is used (0 - uniform sampling, 1 - full
+            prioritization).
+        eps: float
+            Added to the TD errors so that no transition becomes unsampleable.
+        storage_dir, compress, num_envs:
+            See MemoryOptimizedReplayBuffer; the priorities always stay in RAM.
+        """
+        super(PrioritizedReplayBuffer, self).__init__(
+            size, frame_history_len, lander=lander, storage_dir=storage_dir,
+            compress=compress, num_envs=num_envs)
+        assert alpha >= 0
+        self.alpha = alpha
+        self.eps = eps
+
+        tree_capacity = 1
+        while tree_capacity < size:
+            tree_capacity *= 2
+        self._it_sum = SumSegmentTree(tree_capacity)
+        self._it_min = MinSegmentTree(tree_capacity)
+        self._max_priority = 1.0
+
+    def _set_priorities(self, idxes, priorities):
+        priorities = np.broadcast_to(priorities, np.shape(idxes))
+        self._it_sum[idxes] = priorities
+        # transitions that cannot be sampled do not count towards the min
+        self._it_min[idxes] = np.where(priorities > 0, priorities, np.inf)
+
+    def store_frame(self, frame):
+        idx = super(PrioritizedReplayBuffer, self).store_frame(frame)
+        # the new frame has no next frame yet, so its transition cannot be
+        # sampled; the one before it from the same env now can
+        self._set_priorities([idx], 0.0)
+        if self.num_in_buffer > self.num_envs:
+            self._set_priorities([(idx - self.num_envs) % self.size], self._max_priority ** self.alpha)
+        return idx
+
+    def _init_kwargs(self):
+        return {'alpha': self.alpha, 'eps': self.eps}
+
+    def _on_load(self):
+        # the priorities are not stored, so start over from uniform ones
+        if self.num_in_buffer > self.num_envs:
+            oldest_idx = self.next_idx if self.num_in_buffer == self.size else 0
+            idxes = (oldest_idx + np.arange(self.num_in_buffer - self.num_envs)) % self.size
+            self._set_priorities(idxes, self._max_priority ** self.alpha)
+
+    def sample(self, batch_size, beta=0.4, n_step=1, gamma=1.0):
+        """Sample `batch_size` transitions, proportionally to their priorities.
+
+        Parameters
+        ----------
+        batch_size: int
+            How many transitions to sample.
+        beta: float
+            To what degree to correct for the non-uniform sampling (0 - no
+            correction, 1 - full correction).
+        n_step, gamma:
+            As in MemoryOptimizedReplayBuffer.sample
+
+        Returns
+        -------
+        obs_batch, act_batch, rew_batch, next_obs_batch, done_mask[, discount_batch]
+            As in MemoryOptimizedReplayBuffer.sample
+        weights: np.array
+            Array of shape (batch_size,) and dtype np.float32, the importance
+            sampling weight of each transition, scaled so that the largest
+            possible weight is 1
+        idxes: np.array
+            Array of shape (batch_size,) and dtype np.int64, the indices of the
+            sampled transitions, to be passed to `update_priorities`
+        """
+        assert self.can_sample(batch_size)
+        assert beta > 0
+
+        # one sample from each of batch_size equal slices of the total priority
+        total = self._it_sum.sum()
+        prefixsums = (np.arange(batch_size) + np.random.rand(batch_size)) * (total / batch_size)
+        idxes = self._it_sum.find_prefixsum_idx(prefixsums)
+
+        num_candidates = self.num_in_buffer - self.num_envs
+        p_min = self._it_min.min() / total
+        max_weight = (p_min * num_candidates) ** (-beta)
+        p_sample = self._it_sum[idxes] / total
+        assert (p_sample > 0).all(), 'sampled a transition that cannot be sampled'
+        weights = (p_sample * num_candidates) ** (-beta) / max_weight
+
+        encoded_sample = self._encode_sample(idxes, n_step, gamma)
+        return encoded_sample + (weights.astype(np.float32), idxes)
+
+    def update_priorities(self, idxes, td_errors):
+        """Set the priorities of the transitions at `idxes` (as returned by
+        `sample`) from their latest TD errors."""
+        priorities = np.abs(td_errors) + self.eps
+        self._max_priority = max(self._max_priority, priorities.max())
+        self._set_priorities(idxes, priorities ** self.alpha)
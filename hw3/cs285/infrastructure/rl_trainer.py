@@ -14,6 +14,7 @@ from cs285.infrastructure import pytorch_util as ptu
 
 from cs285.infrastructure.utils import Path
 from cs285.infrastructure import utils
+from cs285.infrastructure.batch_prefetcher import BatchPrefetcher
 from cs285.infrastructure.logger import Logger
 
 from cs285.agents.dqn_agent import DQNAgent
@@ -28,6 +29,11 @@ MAX_NVIDEO = 2
 MAX_VIDEO_LEN = 40  # we overwrite this in the code below
 
 
+def _includes_multiple(start, num_steps, freq):
+    # whether one of the num_steps steps from step start is a multiple of freq
+    return (start + num_steps - 1) // freq != (start - 1) // freq
+
+
 class RL_Trainer(object):
 
     def __init__(self, params):
@@ -44,6 +50,15 @@ class RL_Trainer(object):
         seed = self.params['seed']
         np.random.seed(seed)
         torch.manual_seed(seed)
+        if self.params.get('prefetch_batches', False):
+            # a background thread only pays off when it can sample ahead
+            # while several gradient steps in a row run, unlike DQN's single
+            # step per env step
+            assert self.params['num_agent_train_steps_per_iter'] > 1, \
+                'prefetching batches needs num_agent_train_steps_per_iter > 1'
+            # the prefetcher's own random numbers, which it draws while the
+            # main thread uses the global ones
+            self.prefetch_rng = np.random.default_rng(seed)
         ptu.init_gpu(
             use_gpu=not self.params['no_gpu'],
             gpu_id=self.params['which_gpu']
@@ -82,6 +97,16 @@ class RL_Trainer(object):
 
         self.env.seed(seed)
 
+        # more copies of the env, for a DQN agent that steps several at once
+        self.envs = [self.env]
+        for i in range(1, self.params.get('num_envs', 1)):
+            env = gym.make(self.params['env_name'])
+            env = wrappers.RecordEpisodeStatistics(env, deque_size=1000)
+            env = ReturnWrapper(env)
+            env = params['env_wrappers'](env)
+            env.seed(seed + i)
+            self.envs.append(env)
+
         # import plotting (locally if 'obstacles' env)
         if not (self.params['env_name'] == 'obstacles-cs285-v0'):
             import matplotlib
@@ -122,7 +147,10 @@ class RL_Trainer(object):
         #############
 
         agent_class = self.params['agent_class']
-        self.agent = agent_class(self.env, self.params['agent_params'])
+        if len(self.envs) > 1:
+            self.agent = agent_class(self.envs, self.params['agent_params'])
+        else:
+            self.agent = agent_class(self.env, self.params['agent_params'])
 
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           initial_expertdata=None, relabel_with_expert=False,
@@ -143,12 +171,32 @@ class RL_Trainer(object):
 
         print_period = 1000 if isinstance(self.agent, DQNAgent) else 1
 
-        for itr in range(n_iter):
+        # a DQN run takes one iteration per step of each of its envs, so
+        # n_iter and the logging and snapshot frequencies count env steps
+        num_envs = len(self.envs)
+
+        # resume an interrupted DQN run
+        start_itr = 0
+        if isinstance(self.agent, DQNAgent) and self.params['resume_from']:
+            print('\nResuming from snapshot {}'.format(self.params['resume_from']))
+            trainer_state = self.agent.load_snapshot(self.params['resume_from'])
+            if trainer_state is not None:
+                start_itr = trainer_state['itr']
+                self.total_envsteps = trainer_state['total_envsteps']
+            else:
+                # older snapshots only have the agent's count of train calls,
+                # num_agent_train_steps_per_iter per env per iteration
+                start_itr = self.agent.t // (
+                    num_envs * self.params['num_agent_train_steps_per_iter'])
+                self.total_envsteps = start_itr * num_envs
+
+        for itr in range(start_itr, n_iter // num_envs):
             if itr % print_period == 0:
                 print("\n\n********** Iteration %i ************" % itr)
 
             # decide if videos should be rendered/logged at this iteration
-            if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
+            if (self.params['video_log_freq'] != -1 and _includes_multiple(
+                    itr * num_envs, num_envs, self.params['video_log_freq'])):
                 self.logvideo = True
             else:
                 self.logvideo = False
@@ -156,7 +204,7 @@ class RL_Trainer(object):
             # decide if metrics should be logged
             if self.params['scalar_log_freq'] == -1:
                 self.logmetrics = False
-            elif itr % self.params['scalar_log_freq'] == 0:
+            elif _includes_multiple(itr * num_envs, num_envs, self.params['scalar_log_freq']):
                 self.logmetrics = True
             else:
                 self.logmetrics = False
@@ -165,7 +213,7 @@ class RL_Trainer(object):
             if isinstance(self.agent, DQNAgent):
                 # only perform an env step and add to replay buffer for DQN
                 self.agent.step_env()
-                envsteps_this_batch = 1
+                envsteps_this_batch = num_envs
                 train_video_paths = None
                 paths = None
             else:
@@ -197,6 +245,8 @@ class RL_Trainer(object):
                 print('\nBeginning logging procedure...')
                 if isinstance(self.agent, DQNAgent):
                     self.perform_dqn_logging(all_logs)
+                    # checkpoint an on-disk replay buffer along with the logs
+                    self.agent.replay_buffer.flush()
                 else:
                     self.perform_logging(
                         itr, paths, eval_policy, train_video_paths, all_logs)
@@ -205,6 +255,16 @@ class RL_Trainer(object):
                     self.agent.save(
                         '{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
 
+            # snapshot a DQN run so that it can be resumed
+            if (isinstance(self.agent, DQNAgent) and self.params['snapshot_freq'] > 0
+                    and _includes_multiple(itr * num_envs + 1, num_envs, self.params['snapshot_freq'])):
+                self.agent.save_snapshot(
+                    os.path.join(self.params['logdir'], 'snapshot'),
+                    trainer_state={'itr': itr + 1, 'total_envsteps': self.total_envsteps})
+
+        if isinstance(self.agent, DQNAgent):
+            self.agent.replay_buffer.flush()
+
     ####################################
     ####################################
 
@@ -334,20 +394,36 @@ class RL_Trainer(object):
     def train_agent(self):
         # Decrease logging a bit
         all_logs = []
-        for train_step in range(self.params['num_agent_train_steps_per_iter']):
-
-            # TODO sample some data from the data buffer
-            # HINT1: use the agent's sample function
-            # HINT2: how much data = self.params['train_batch_size']
-            ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = self.agent.sample(
-                self.params['train_batch_size'])
-
-            # TODO use the sampled data to train an agent
-            # HINT: use the agent's train function
-            # HINT: keep the agent's training log for debugging
-            train_log = self.agent.train(
-                ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch)
-            all_logs.append(train_log)
+
+        # TODO sample some data from the data buffer
+        # HINT1: use the agent's sample function
+        # HINT2: how much data = self.params['train_batch_size']
+        # an agent stepping several envs at once trains as often per env step
+        # as one with a single env
+        num_train_steps = self.params['num_agent_train_steps_per_iter'] * len(self.envs)
+        if self.params.get('prefetch_batches', False):
+            # sample and convert the batches in a background thread instead;
+            # the agent's train function then gets torch tensors
+            batches = BatchPrefetcher(
+                self.agent.sample, self.params['train_batch_size'], num_train_steps,
+                self.prefetch_rng, pin_memory=self.params['pin_memory'])
+        else:
+            batches = (self.agent.sample(self.params['train_batch_size'])
+                       for _ in range(num_train_steps))
+
+        try:
+            for ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch in batches:
+
+                # TODO use the sampled data to train an agent
+                # HINT: use the agent's train function
+                # HINT: keep the agent's training log for debugging
+                train_log = self.agent.train(
+                    ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch)
+                all_logs.append(train_log)
+        finally:
+            # stops the prefetcher's thread if train raised before all its
+            # batches were used (and is a no-op for the generator)
+            batches.close()
         return all_logs
 
     ####################################
@@ -355,10 +431,14 @@ class RL_Trainer(object):
     def perform_dqn_logging(self, all_logs):
         last_log = all_logs[-1]
 
-        episode_rewards = self.env.get_episode_rewards()
-        if len(episode_rewards) > 0:
-            self.mean_episode_reward = np.mean(episode_rewards[-100:])
-        if len(episode_rewards) > 100:
+        episode_rewards = [env.get_episode_rewards() for env in self.envs]
+        num_episodes = sum(len(rewards) for rewards in episode_rewards)
+        # the last 100 episodes, as many from each env
+        num_recent = -(-100 // len(self.envs))
+        recent_rewards = np.concatenate([rewards[-num_recent:] for rewards in episode_rewards])
+        if num_episodes > 0:
+            self.mean_episode_reward = np.mean(recent_rewards)
+        if num_episodes > 100:
             self.best_mean_episode_reward = max(
                 self.best_mean_episode_reward, self.mean_episode_reward)
 
@@ -7,7 +7,9 @@ class ArgMaxPolicy(object):
         self.critic = critic
 
     def get_action(self, obs):
-        if len(obs.shape) > 3:
+        # a batch of observations (e.g. one from each of several envs), or a
+        # single one
+        if len(obs.shape) > len(self.critic.input_shape):
             observation = obs
         else:
             observation = obs[None]
@@ -55,6 +55,16 @@ def main():
     parser.add_argument('--num_agent_train_steps_per_iter', type=int, default=1)
     parser.add_argument('--num_critic_updates_per_agent_update', type=int, default=1)
     parser.add_argument('--double_q', action='store_true')
+    parser.add_argument('--fused_double_q', action='store_true') #with double_q, one q_net forward pass over the observations and next observations together
+    parser.add_argument('--prioritized_replay', action='store_true')
+    parser.add_argument('--prioritized_replay_alpha', type=float, default=0.6)
+    parser.add_argument('--prioritized_replay_beta', type=float, default=0.4)
+    parser.add_argument('--memmap_replay', action='store_true')
+    parser.add_argument('--n_step', type=int, default=1)
+    parser.add_argument('--replay_compression', choices=('zlib', 'lz4'), default=None)
+    parser.add_argument('--prefetch_batches', action='store_true') #needs num_agent_train_steps_per_iter > 1
+    parser.add_argument('--pin_memory', action='store_true')
+    parser.add_argument('--num_envs', type=int, default=1) #step this many envs at once, with batched action selection
 
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--no_gpu', '-ngpu', action='store_true')
@@ -63,6 +73,8 @@ def main():
     parser.add_argument('--video_log_freq', type=int, default=-1)
 
     parser.add_argument('--save_params', action='store_true')
+    parser.add_argument('--snapshot_freq', type=int, default=-1)  # in env steps
+    parser.add_argument('--resume_from', type=str, default=None)  # snapshot dir of an earlier run
 
     args = parser.parse_args()
 
@@ -19,7 +19,8 @@ class SAC_Trainer(object):
             'learning_rate': params['learning_rate'],
             'init_temperature': params['init_temperature'],
             'actor_update_frequency': params['actor_update_frequency'],
-            'critic_target_update_frequency': params['critic_target_update_frequency']
+            'critic_target_update_frequency': params['critic_target_update_frequency'],
+            'torch_replay': params['torch_replay'],
             }
 
         estimate_advantage_args = {
@@ -70,6 +71,9 @@ def main():
     parser.add_argument('--batch_size', '-b', type=int, default=1000) #steps collected per train iteration
     parser.add_argument('--eval_batch_size', '-eb', type=int, default=400) #steps collected per eval iteration
     parser.add_argument('--train_batch_size', '-tb', type=int, default=256) ##steps used per gradient step
+    parser.add_argument('--prefetch_batches', action='store_true') #needs num_agent_train_steps_per_iter > 1
+    parser.add_argument('--pin_memory', action='store_true')
+    parser.add_argument('--torch_replay', action='store_true')
 
     parser.add_argument('--discount', type=float, default=0.99)
     parser.add_argument('--init_temperature', '-temp', type=float, default=1.0)
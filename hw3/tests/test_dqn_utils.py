@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+
+from cs285.infrastructure.dqn_utils import (
+    MemoryOptimizedReplayBuffer, PrioritizedReplayBuffer, SumSegmentTree)
+
+
+def _partly_filled_buffer(num_transitions, size=20):
+    buffer = MemoryOptimizedReplayBuffer(size, 1, lander=True)
+    rng = np.random.RandomState(0)
+    for t in range(num_transitions):
+        idx = buffer.store_frame(rng.rand(8).astype(np.float32))
+        buffer.store_effect(idx, t % 4, float(t + 1), t == 6)
+    # what np.empty may leave in the slots that have not been written yet
+    buffer.reward[num_transitions:] = np.nan
+    buffer.done[num_transitions:] = False
+    return buffer
+
+
+def test_n_step_sample_ignores_unwritten_rewards():
+    buffer = _partly_filled_buffer(10)
+    idxes = np.arange(buffer.num_in_buffer - 1)
+    obs, act, rew, next_obs, done, discount = buffer._encode_sample(idxes, n_step=4, gamma=0.5)
+
+    assert np.isfinite(rew).all()
+    for i, idx in enumerate(idxes):
+        # steps up to the end of the episode (at 6) or the newest stored transition (at 8)
+        last = min(idx + 3, 6 if idx <= 6 else 8)
+        expected = sum(0.5 ** k * (idx + k + 1) for k in range(last - idx + 1))
+        assert np.isclose(rew[i], expected)
+        assert np.isclose(discount[i], 0.5 ** (last - idx + 1))
+        assert done[i] == (last == 6)
+
+
+def test_n_step_sample_from_partly_filled_buffer():
+    buffer = _partly_filled_buffer(5)
+    obs, act, rew, next_obs, done, discount = buffer.sample(4, n_step=3, gamma=0.9)
+    assert np.isfinite(rew).all()
+    assert np.isfinite(discount).all()
+
+
+def test_load_snapshot_after_interrupted_save(tmp_path):
+    buffer = _partly_filled_buffer(10)
+    path = str(tmp_path / 'replay')
+    os.makedirs(path + '.old')  # left behind by an earlier crash
+    buffer.save_snapshot(path)
+    assert not os.path.exists(path + '.old')
+
+    # a crash between moving the snapshot aside and moving the new one in place
+    os.rename(path, path + '.old')
+    restored = MemoryOptimizedReplayBuffer(buffer.size, 1, lander=True)
+    restored.load_snapshot(path)
+    assert restored.num_in_buffer == 10
+    assert np.array_equal(restored.reward[:10], buffer.reward[:10])
+
+    buffer.save_snapshot(path)
+    assert os.path.exists(path) and not os.path.exists(path + '.old')
+
+
+def test_sum_tree_samples_proportionally_to_values():
+    tree = SumSegmentTree(8)
+    values = np.array([1., 0., 3., 2., 0., 4.])
+    tree[np.arange(6)] = values
+    rng = np.random.RandomState(0)
+    idxes = tree.find_prefixsum_idx(rng.rand(100000) * tree.sum())
+    freqs = np.bincount(idxes, minlength=8) / len(idxes)
+    assert np.allclose(freqs[:6], values / values.sum(), atol=0.01)
+    assert (freqs[:6][values == 0] == 0).all() and (freqs[6:] == 0).all()
+
+
+def test_sum_tree_never_returns_a_zero_value():
+    tree = SumSegmentTree(64)
+    rng = np.random.RandomState(0)
+    values = rng.rand(50) * (rng.rand(50) < 0.5)
+    tree[np.arange(50)] = values
+    total = tree.sum()
+    # the extremes of the range, past them, and random ones
+    prefixsums = np.concatenate([[0., total, total * (1 + 1e-9), -1.], rng.rand(1000) * total])
+    idxes = tree.find_prefixsum_idx(prefixsums)
+    assert (idxes < 50).all()
+    assert (values[idxes] > 0).all()
+
+
+def _prioritized_buffer(num_transitions, size=32, alpha=0.7):
+    buffer = PrioritizedReplayBuffer(size, 1, alpha=alpha, lander=True)
+    rng = np.random.RandomState(0)
+    for t in range(num_transitions):
+        idx = buffer.store_frame(rng.rand(8).astype(np.float32))
+        buffer.store_effect(idx, t % 4, 1., False)
+    return buffer
+
+
+def test_prioritized_sample_frequencies_and_weights():
+    buffer = _prioritized_buffer(20)
+    # every transition but the newest, which has no next frame yet
+    idxes = np.arange(19)
+    td_errors = np.arange(19) % 5 + 0.5
+    buffer.update_priorities(idxes, td_errors)
+    priorities = (td_errors + buffer.eps) ** buffer.alpha
+
+    np.random.seed(0)
+    counts = np.zeros(32)
+    for _ in range(500):
+        *_, weights, sampled = buffer.sample(16, beta=0.5)
+        assert (sampled < 19).all()
+        assert (weights > 0).all() and (weights <= 1).all()
+        np.add.at(counts, sampled, 1)
+    assert np.allclose(counts[:19] / counts.sum(), priorities / priorities.sum(), atol=0.01)
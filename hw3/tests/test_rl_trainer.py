@@ -0,0 +1,92 @@
+import os
+import threading
+
+import gym
+import numpy as np
+import pytest
+from gym import spaces
+from gym.envs.registration import EnvSpec, registry
+
+from cs285.agents.dqn_agent import DQNAgent
+from cs285.scripts import run_hw3_dqn
+from cs285.scripts.run_hw3_dqn import Q_Trainer
+
+
+class _TinyLander(gym.Env):
+    """Stand-in for LunarLander, which needs Box2D: random observations of the
+    same shape, and episodes of 20 steps."""
+    observation_space = spaces.Box(-1, 1, (8,), np.float32)
+    action_space = spaces.Discrete(4)
+
+    def reset(self):
+        self.t = 0
+        return self.observation_space.sample()
+
+    def step(self, action):
+        self.t += 1
+        return self.observation_space.sample(), float(action == 1), self.t >= 20, {}
+
+    def seed(self, seed=None):
+        self.observation_space.seed(seed)
+        return [seed]
+
+
+@pytest.fixture
+def tiny_lander(monkeypatch):
+    monkeypatch.setitem(registry.env_specs, 'LunarLander-v3', EnvSpec(
+        'LunarLander-v3', entry_point=_TinyLander, max_episode_steps=1000))
+
+    get_env_kwargs = run_hw3_dqn.get_env_kwargs
+    def small_env_kwargs(env_name):
+        kwargs = get_env_kwargs(env_name)
+        kwargs.update(num_timesteps=200, learning_starts=50, replay_buffer_size=1000)
+        return kwargs
+    monkeypatch.setattr(run_hw3_dqn, 'get_env_kwargs', small_env_kwargs)
+
+
+def _dqn_params(logdir, **overrides):
+    # the defaults of run_hw3_dqn.py
+    params = {
+        'env_name': 'LunarLander-v3', 'ep_len': 200, 'exp_name': 'test',
+        'eval_batch_size': 1000, 'batch_size': 32,
+        'num_agent_train_steps_per_iter': 1, 'num_critic_updates_per_agent_update': 1,
+        'double_q': False, 'fused_double_q': False,
+        'prioritized_replay': False, 'prioritized_replay_alpha': 0.6,
+        'prioritized_replay_beta': 0.4, 'memmap_replay': False, 'n_step': 1,
+        'replay_compression': None, 'prefetch_batches': False, 'pin_memory': False,
+        'num_envs': 1, 'seed': 1, 'no_gpu': True, 'which_gpu': 0,
+        'scalar_log_freq': int(1e4), 'video_log_freq': -1, 'save_params': False,
+        'snapshot_freq': -1, 'resume_from': None, 'logdir': str(logdir),
+    }
+    params.update(overrides)
+    return params
+
+
+def test_resume_with_several_train_steps_per_iter(tiny_lander, tmp_path):
+    # snapshotted after 150 of the 200 env steps
+    first = Q_Trainer(_dqn_params(
+        tmp_path / 'first', num_agent_train_steps_per_iter=2, snapshot_freq=150))
+    first.run_training_loop()
+    assert first.rl_trainer.agent.t == 400
+
+    resumed = Q_Trainer(_dqn_params(
+        tmp_path / 'resumed', num_agent_train_steps_per_iter=2,
+        resume_from=os.path.join(str(tmp_path / 'first'), 'snapshot')))
+    resumed.run_training_loop()
+
+    # only the last 50 env steps are run again, with 2 train calls each
+    assert resumed.rl_trainer.total_envsteps == 200
+    assert resumed.rl_trainer.agent.t == 300 + 50 * 2
+
+
+def test_prefetcher_stops_when_train_raises(tiny_lander, tmp_path, monkeypatch):
+    def failing_train(self, *batch):
+        raise RuntimeError('train failed')
+    monkeypatch.setattr(DQNAgent, 'train', failing_train)
+
+    trainer = Q_Trainer(_dqn_params(
+        tmp_path, num_agent_train_steps_per_iter=4, prefetch_batches=True))
+    num_threads = threading.active_count()
+    with pytest.raises(RuntimeError):
+        trainer.run_training_loop()
+    assert threading.active_count() == num_threads
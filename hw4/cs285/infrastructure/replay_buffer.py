@@ -1,3 +1,5 @@
+from collections import deque
+
 from cs285.infrastructure.utils import *
 
 
@@ -6,77 +8,139 @@ class ReplayBuffer(object):
     def __init__(self, max_size=1000000):
 
         self.max_size = max_size
-        self.paths = []
-        self.obs = None
-        self.acs = None
-        self.concatenated_rews = None
-        self.next_obs = None
-        self.terminals = None
+
+        # circular storage for the component arrays, preallocated to max_size
+        # on the first add_rollouts call
+        self._obs = None
+        self._acs = None
+        self._rews = None
+        self._next_obs = None
+        self._terminals = None
+        self.next_idx = 0  # where the next transition gets written
+        self.size = 0  # number of valid transitions
+
+        # lengths of the rollouts that are still fully stored, oldest first
+        self.path_lengths = deque()
+        self.num_path_transitions = 0
+
+    def __len__(self):
+        return self.size
+
+    # views of the valid part of the storage (in storage, not insertion, order)
+    @property
+    def obs(self):
+        return None if self._obs is None else self._obs[:self.size]
+
+    @property
+    def acs(self):
+        return None if self._acs is None else self._acs[:self.size]
+
+    @property
+    def concatenated_rews(self):
+        return None if self._rews is None else self._rews[:self.size]
+
+    @property
+    def next_obs(self):
+        return None if self._next_obs is None else self._next_obs[:self.size]
+
+    @property
+    def terminals(self):
+        return None if self._terminals is None else self._terminals[:self.size]
 
     def add_rollouts(self, paths, noised=False):
 
-        # add new rollouts into our list of rollouts
+        # remember where each rollout starts and ends
         for path in paths:
-            self.paths.append(path)
+            self.path_lengths.append(get_pathlength(path))
+            self.num_path_transitions += get_pathlength(path)
 
-        # convert new rollouts into their component arrays, and append them onto our arrays
+        # convert new rollouts into their component arrays, and write them into our arrays
         observations, actions, next_observations, terminals, concatenated_rews, unconcatenated_rews = convert_listofrollouts(paths)
 
         if noised:
             observations = add_noise(observations)
             next_observations = add_noise(next_observations)
 
-        if self.obs is None:
-            self.obs = observations[-self.max_size:]
-            self.acs = actions[-self.max_size:]
-            self.next_obs = next_observations[-self.max_size:]
-            self.terminals = terminals[-self.max_size:]
-            self.concatenated_rews = concatenated_rews[-self.max_size:]
-        else:
-            self.obs = np.concatenate([self.obs, observations])[-self.max_size:]
-            self.acs = np.concatenate([self.acs, actions])[-self.max_size:]
-            self.next_obs = np.concatenate(
-                [self.next_obs, next_observations]
-            )[-self.max_size:]
-            self.terminals = np.concatenate(
-                [self.terminals, terminals]
-            )[-self.max_size:]
-            self.concatenated_rews = np.concatenate(
-                [self.concatenated_rews, concatenated_rews]
-            )[-self.max_size:]
+        self._store(observations, actions, concatenated_rews, next_observations, terminals)
+
+        # forget the rollouts that have (partly) been overwritten
+        while self.num_path_transitions > self.size:
+            self.num_path_transitions -= self.path_lengths.popleft()
+
+    def _store(self, observations, actions, rewards, next_observations, terminals):
+        if self._obs is None:
+            self._obs = np.empty((self.max_size,) + observations.shape[1:], dtype=observations.dtype)
+            self._acs = np.empty((self.max_size,) + actions.shape[1:], dtype=actions.dtype)
+            self._rews = np.empty((self.max_size,) + rewards.shape[1:], dtype=rewards.dtype)
+            self._next_obs = np.empty((self.max_size,) + next_observations.shape[1:], dtype=next_observations.dtype)
+            self._terminals = np.empty((self.max_size,) + terminals.shape[1:], dtype=terminals.dtype)
+
+        # only the last max_size transitions would survive anyway
+        num_new = min(len(observations), self.max_size)
+        indices = (self.next_idx + np.arange(num_new)) % self.max_size
+        self._obs[indices] = observations[-num_new:]
+        self._acs[indices] = actions[-num_new:]
+        self._rews[indices] = rewards[-num_new:]
+        self._next_obs[indices] = next_observations[-num_new:]
+        self._terminals[indices] = terminals[-num_new:]
+
+        self.next_idx = (self.next_idx + num_new) % self.max_size
+        self.size = min(self.size + num_new, self.max_size)
+
+    def _recent_indices(self, num):
+        """
+            Storage indices of the last num transitions, oldest first
+        """
+        num = min(num, self.size)
+        return (self.next_idx - num + np.arange(num)) % self.max_size
+
+    def _get_paths(self, path_ids):
+        """
+            Rebuild the stored rollouts with the given (oldest first) ids
+        """
+        lengths = np.array(self.path_lengths)
+        # number of transitions from the start of each rollout to the newest one
+        suffix_lengths = np.cumsum(lengths[::-1])[::-1]
+        paths = []
+        for path_id in path_ids:
+            indices = self._recent_indices(suffix_lengths[path_id])[:lengths[path_id]]
+            paths.append(Path(self._obs[indices], [], self._acs[indices], self._rews[indices],
+                              self._next_obs[indices], self._terminals[indices]))
+        return paths
 
     ########################################
     ########################################
 
     def sample_random_rollouts(self, num_rollouts):
-        rand_indices = np.random.permutation(len(self.paths))[:num_rollouts]
-        return self.paths[rand_indices]
+        rand_indices = np.random.permutation(len(self.path_lengths))[:num_rollouts]
+        return self._get_paths(rand_indices)
 
     def sample_recent_rollouts(self, num_rollouts=1):
-        return self.paths[-num_rollouts:]
+        num_paths = len(self.path_lengths)
+        return self._get_paths(range(max(num_paths - num_rollouts, 0), num_paths))
 
     ########################################
     ########################################
 
     def sample_random_data(self, batch_size):
 
-        assert self.obs.shape[0] == self.acs.shape[0] == self.concatenated_rews.shape[0] == self.next_obs.shape[0] == self.terminals.shape[0]
-        rand_indices = np.random.permutation(self.obs.shape[0])[:batch_size]
-        return self.obs[rand_indices], self.acs[rand_indices], self.concatenated_rews[rand_indices], self.next_obs[rand_indices], self.terminals[rand_indices]
+        rand_indices = np.random.permutation(self.size)[:batch_size]
+        return self._obs[rand_indices], self._acs[rand_indices], self._rews[rand_indices], self._next_obs[rand_indices], self._terminals[rand_indices]
 
     def sample_recent_data(self, batch_size=1, concat_rew=True):
 
         if concat_rew:
-            return self.obs[-batch_size:], self.acs[-batch_size:], self.concatenated_rews[-batch_size:], self.next_obs[-batch_size:], self.terminals[-batch_size:]
+            indices = self._recent_indices(batch_size)
+            return self._obs[indices], self._acs[indices], self._rews[indices], self._next_obs[indices], self._terminals[indices]
         else:
             num_recent_rollouts_to_return = 0
             num_datapoints_so_far = 0
             index = -1
             while num_datapoints_so_far < batch_size:
-                recent_rollout = self.paths[index]
-                index -=1
-                num_recent_rollouts_to_return +=1
-                num_datapoints_so_far += get_pathlength(recent_rollout)
-            rollouts_to_return = self.paths[-num_recent_rollouts_to_return:]
-            observations, actions, next_observations, terminals, concatenated_rews, unconcatenated_rews = convert_listofrollouts(rollouts_to_return)
-            return observations, actions, unconcatenated_rews, next_observations, terminals
+                num_datapoints_so_far += self.path_lengths[index]
+                index -= 1
+                num_recent_rollouts_to_return += 1
+            lengths = [self.path_lengths[i] for i in range(-num_recent_rollouts_to_return, 0)]
+            indices = self._recent_indices(num_datapoints_so_far)
+            unconcatenated_rews = np.split(self._rews[indices], np.cumsum(lengths)[:-1])
+            return self._obs[indices], self._acs[indices], unconcatenated_rews, self._next_obs[indices], self._terminals[indices]
@@ -30,25 +30,18 @@ def calculate_mean_prediction_error(env, action_sequence, models, data_statistic
 
 def perform_actions(env, actions):
     ob = env.reset()
-    obs, acs, rewards, next_obs, terminals, image_obs = [], [], [], [], [], []
-    steps = 0
+    traj = TrajectoryBuilder(env, len(actions))
     for ac in actions:
-        obs.append(ob)
-        acs.append(ac)
-        ob, rew, done, _ = env.step(ac)
+        next_ob, rew, done, _ = env.step(ac)
         # add the observation after taking a step to next_obs
-        next_obs.append(ob)
-        rewards.append(rew)
-        steps += 1
         # If the episode ended, the corresponding terminal value is 1
         # otherwise, it is 0
+        traj.add(ob, ac, rew, next_ob, done)
+        ob = next_ob
         if done:
-            terminals.append(1)
             break
-        else:
-            terminals.append(0)
 
-    return Path(obs, image_obs, acs, rewards, next_obs, terminals)
+    return traj.build()
 
 
 def mean_squared_error(a, b):
@@ -60,41 +53,34 @@ def mean_squared_error(a, b):
 
 def sample_trajectory(env, policy, max_path_length, render=False, render_mode=('rgb_array')):
     ob = env.reset()
-    obs, acs, rewards, next_obs, terminals, image_obs = [], [], [], [], [], []
-    steps = 0
+    traj = TrajectoryBuilder(env, max_path_length + 1)
     while True:
         if render:
             if 'rgb_array' in render_mode:
                 if hasattr(env, 'sim'):
                     if 'track' in env.env.model.camera_names:
-                        image_obs.append(env.sim.render(
+                        traj.add_image(env.sim.render(
                             camera_name='track', height=500, width=500)[::-1])
                     else:
-                        image_obs.append(env.sim.render(
+                        traj.add_image(env.sim.render(
                             height=500, width=500)[::-1])
                 else:
-                    image_obs.append(env.render(mode=render_mode))
+                    traj.add_image(env.render(mode=render_mode))
             if 'human' in render_mode:
                 env.render(mode=render_mode)
                 time.sleep(env.model.opt.timestep)
-        obs.append(ob)
         ac = policy.get_action(ob)
         ac = ac[0]
-        acs.append(ac)
-        ob, rew, done, _ = env.step(ac)
-        # add the observation after taking a step to next_obs
-        next_obs.append(ob)
-        rewards.append(rew)
-        steps += 1
+        next_ob, rew, done, _ = env.step(ac)
         # If the episode ended, the corresponding terminal value is 1
         # otherwise, it is 0
-        if done or steps > max_path_length:
-            terminals.append(1)
+        rollout_done = done or traj.steps + 1 > max_path_length
+        traj.add(ob, ac, rew, next_ob, rollout_done)
+        ob = next_ob
+        if rollout_done:
             break
-        else:
-            terminals.append(0)
 
-    return Path(obs, image_obs, acs, rewards, next_obs, terminals)
+    return traj.build()
 
 
 def sample_trajectories(env, policy, min_timesteps_per_batch, max_path_length, render=False, render_mode=('rgb_array')):
@@ -149,6 +135,52 @@ def Path(obs, image_obs, acs, rewards, next_obs, terminals):
             "terminal": np.array(terminals, dtype=np.float32)}
 
 
+class TrajectoryBuilder(object):
+    """
+        Preallocates the arrays of a single rollout, sized from the env spaces
+        and the maximum number of steps, and writes each step into them in place.
+
+        build() returns the same dictionary as Path, with views trimmed to the
+        length of the rollout.
+    """
+
+    def __init__(self, env, max_path_length):
+        ob_shape = env.observation_space.shape
+        ac_shape = env.action_space.shape
+        self.obs = np.empty((max_path_length,) + ob_shape, dtype=np.float32)
+        self.acs = np.empty((max_path_length,) + ac_shape, dtype=np.float32)
+        self.rewards = np.empty(max_path_length, dtype=np.float32)
+        self.next_obs = np.empty((max_path_length,) + ob_shape, dtype=np.float32)
+        self.terminals = np.empty(max_path_length, dtype=np.float32)
+        self.image_obs = []
+        self.steps = 0
+
+    def add(self, ob, ac, rew, next_ob, terminal):
+        t = self.steps
+        self.obs[t] = ob
+        self.acs[t] = ac
+        self.rewards[t] = rew
+        self.next_obs[t] = next_ob
+        self.terminals[t] = terminal
+        self.steps += 1
+
+    def add_image(self, image):
+        self.image_obs.append(image)
+
+    def build(self):
+        t = self.steps
+        if self.image_obs:
+            image_obs = np.stack(self.image_obs, axis=0).astype(np.uint8)
+        else:
+            image_obs = np.array([], dtype=np.uint8)
+        return {"observation": self.obs[:t],
+                "image_obs": image_obs,
+                "reward": self.rewards[:t],
+                "action": self.acs[:t],
+                "next_observation": self.next_obs[:t],
+                "terminal": self.terminals[:t]}
+
+
 def convert_listofrollouts(paths):
     """
         Take a list of rollout dictionaries
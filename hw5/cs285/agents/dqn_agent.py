@@ -1,7 +1,9 @@
+import os
+
 import numpy as np
 import pdb
 
-from cs285.infrastructure.dqn_utils import MemoryOptimizedReplayBuffer, PiecewiseSchedule
+from cs285.infrastructure.dqn_utils import MemoryOptimizedReplayBuffer, PrioritizedReplayBuffer, LinearSchedule, PiecewiseSchedule
 from cs285.policies.argmax_policy import ArgMaxPolicy
 from cs285.critics.dqn_critic import DQNCritic
 
@@ -9,11 +11,20 @@ from cs285.critics.dqn_critic import DQNCritic
 class DQNAgent(object):
     def __init__(self, env, agent_params):
 
-        self.env = env
+        # a list of envs is stepped all together by agents that support it
+        if isinstance(env, list):
+            self.envs = env
+        else:
+            self.envs = [env]
+        self.num_envs = len(self.envs)
+        self.env = self.envs[0]
         self.agent_params = agent_params
         self.batch_size = agent_params['batch_size']
         # import ipdb; ipdb.set_trace()
-        self.last_obs = self.env.reset()
+        if self.num_envs > 1:
+            self.last_obs = [env.reset() for env in self.envs]
+        else:
+            self.last_obs = self.env.reset()
 
         self.num_actions = agent_params['ac_dim']
         self.learning_starts = agent_params['learning_starts']
@@ -30,9 +41,40 @@ class DQNAgent(object):
         lander = agent_params['env_name'].startswith('LunarLander')
         self.replay_buffer = MemoryOptimizedReplayBuffer(
             agent_params['replay_buffer_size'], agent_params['frame_history_len'], lander=lander)
+        # importance weights and indices of the last prioritized sample
+        self.sample_weights = None
+        self.sample_idxes = None
+        # length of the sampled transitions, and the per-transition discounts
+        # and indices of the last n-step sample
+        self.n_step = 1
+        self.sample_discounts = None
+        self.sample_n_step_idxes = None
         self.t = 0
         self.num_param_updates = 0
 
+    def make_replay_buffer(self, size, frame_history_len, **buffer_kwargs):
+        """
+            A PrioritizedReplayBuffer if agent_params['prioritized_replay'] is set,
+            a MemoryOptimizedReplayBuffer otherwise; kept in memory-mapped files
+            in the run's logdir if agent_params['memmap_replay'] is set, and
+            holding the transitions of all the agent's envs
+        """
+        # the transitions of the envs are stored side by side, so size must be
+        # a multiple of their number
+        size -= size % self.num_envs
+        buffer_kwargs['num_envs'] = self.num_envs
+        if self.agent_params['memmap_replay']:
+            buffer_kwargs['storage_dir'] = os.path.join(self.agent_params['logdir'], 'replay')
+        if not self.agent_params['prioritized_replay']:
+            return MemoryOptimizedReplayBuffer(size, frame_history_len, **buffer_kwargs)
+        # anneal the importance sampling correction to full by the end of training
+        self.prioritized_replay_beta = LinearSchedule(
+            self.agent_params['num_timesteps'], 1.0,
+            initial_p=self.agent_params['prioritized_replay_beta'])
+        return PrioritizedReplayBuffer(
+            size, frame_history_len,
+            alpha=self.agent_params['prioritized_replay_alpha'], **buffer_kwargs)
+
     def add_to_replay_buffer(self, paths):
         pass
 
@@ -51,7 +93,18 @@ class DQNAgent(object):
 
     def sample(self, batch_size):
         if self.replay_buffer.can_sample(self.batch_size):
-            return self.replay_buffer.sample(batch_size)
+            n_step_kwargs = dict(n_step=self.n_step, gamma=self.agent_params['gamma'])
+            if isinstance(self.replay_buffer, PrioritizedReplayBuffer):
+                *batch, self.sample_weights, self.sample_idxes = self.replay_buffer.sample(
+                    batch_size, beta=self.prioritized_replay_beta.value(self.t), **n_step_kwargs)
+                idxes = self.sample_idxes
+            else:
+                *batch, idxes = self.replay_buffer.sample(
+                    batch_size, return_idxes=True, **n_step_kwargs)
+            if self.n_step > 1:
+                *batch, self.sample_discounts = batch
+                self.sample_n_step_idxes = idxes
+            return batch
         else:
             return [],[],[],[],[]
 
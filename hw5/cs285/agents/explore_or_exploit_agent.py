@@ -15,9 +15,10 @@ class ExplorationOrExploitationAgent(DQNAgent):
     def __init__(self, env, agent_params, normalize_rnd=True, rnd_gamma=0.99):
         super(ExplorationOrExploitationAgent, self).__init__(env, agent_params)
 
-        self.replay_buffer = MemoryOptimizedReplayBuffer(
+        self.replay_buffer = self.make_replay_buffer(
             100000, 1, float_obs=True)
         self.num_exploration_steps = agent_params['num_exploration_steps']
+        self.n_step = agent_params['n_step']
         self.offline_exploitation = agent_params['offline_exploitation']
 
         self.exploitation_critic = CQLCritic(agent_params, self.optimizer_spec)
@@ -69,18 +70,36 @@ class ExplorationOrExploitationAgent(DQNAgent):
             if not isinstance(exploration_bonus, (np.ndarray, np.generic)):
                 exploration_bonus = ptu.to_numpy(exploration_bonus)
 
+            if self.sample_discounts is not None:
+                # an n-step transition also passes through the states after
+                # ob_no, whose bonuses are discounted and summed like its rewards
+                step_obs, taken = self.replay_buffer.encode_n_step_observations(
+                    self.sample_n_step_idxes, self.n_step)
+                step_discounts = np.where(
+                    taken, self.agent_params['gamma'] ** np.arange(self.n_step), 0.)
+                later_bonus = self.exploration_model.forward_np(
+                    step_obs[:, 1:].reshape((-1,) + step_obs.shape[2:]))
+                later_bonus = later_bonus.reshape(taken[:, 1:].shape)
+
             if self.normalize_rnd:
                 exp_bonus_mean = exploration_bonus.mean()
                 exp_bonus_std = exploration_bonus.std()
 
                 exploration_bonus = normalize(
                     exploration_bonus, exp_bonus_mean, self.running_rnd_rew_std)
+                if self.sample_discounts is not None:
+                    later_bonus = normalize(
+                        later_bonus, exp_bonus_mean, self.running_rnd_rew_std)
 
                 # Exp moving avg
                 self.running_rnd_rew_std = self.running_rnd_rew_std * \
                     self.rnd_gamma + exp_bonus_std * (1 - self.rnd_gamma)
 
             expl_bonus = exploration_bonus
+            if self.sample_discounts is not None:
+                # the slots of steps not taken may hold any observation
+                expl_bonus = expl_bonus + (
+                    np.where(taken[:, 1:], later_bonus, 0.) * step_discounts[:, 1:]).sum(axis=1)
 
             # Reward Calculations #
             # TODO: Calculate mixed rewards, which will be passed into the exploration critic
@@ -91,8 +110,15 @@ class ExplorationOrExploitationAgent(DQNAgent):
             # HINT: For part 1, env_reward is just 're_n'
             #       After this, env_reward is 're_n' shifted by self.exploit_rew_shift,
             #       and scaled by self.exploit_rew_scale
-            env_reward = (re_n + self.exploit_rew_shift) * \
-                self.exploit_rew_scale
+            if self.sample_discounts is None:
+                env_reward = (re_n + self.exploit_rew_shift) * \
+                    self.exploit_rew_scale
+            else:
+                # n-step rewards get the shift once for every (discounted)
+                # step they sum over
+                num_discounted_steps = step_discounts.sum(axis=1)
+                env_reward = (re_n + self.exploit_rew_shift * num_discounted_steps) * \
+                    self.exploit_rew_scale
 
             # Update Critics And Exploration Model #
 
@@ -101,9 +127,19 @@ class ExplorationOrExploitationAgent(DQNAgent):
             # TODO 3): Update the exploitation critic (based off env_reward)
             expl_model_loss = self.exploration_model.update(next_ob_no)
             exploration_critic_loss = self.exploration_critic.update(
-                ob_no, ac_na, next_ob_no, mixed_reward, terminal_n)
+                ob_no, ac_na, next_ob_no, mixed_reward, terminal_n,
+                weights=self.sample_weights, discount_n=self.sample_discounts)
             exploitation_critic_loss = self.exploitation_critic.update(
-                ob_no, ac_na, next_ob_no, env_reward, terminal_n)
+                ob_no, ac_na, next_ob_no, env_reward, terminal_n,
+                weights=self.sample_weights, discount_n=self.sample_discounts)
+
+            # Prioritize by the TD errors of the critic the actor follows
+            if self.sample_idxes is not None:
+                if self.actor.critic is self.exploitation_critic:
+                    td_errors = exploitation_critic_loss['TD Errors']
+                else:
+                    td_errors = exploration_critic_loss['TD Errors']
+                self.replay_buffer.update_priorities(self.sample_idxes, td_errors)
 
             # Target Networks #
             if self.num_param_updates % self.target_update_freq == 0:
@@ -133,7 +169,13 @@ class ExplorationOrExploitationAgent(DQNAgent):
             At the end of this block of code, the simulator should have been
             advanced one step, and the replay buffer should contain one more transition.
             Note that self.last_obs must always point to the new latest observation.
+
+            With several envs, each of them is advanced one step instead, see
+            _step_envs.
         """
+        if self.num_envs > 1:
+            return self._step_envs()
+
         if (not self.offline_exploitation) or (self.t <= self.num_exploration_steps):
             self.replay_buffer_idx = self.replay_buffer.store_frame(
                 self.last_obs)
@@ -156,3 +198,35 @@ class ExplorationOrExploitationAgent(DQNAgent):
 
         if done:
             self.last_obs = self.env.reset()
+
+    def _step_envs(self):
+        """
+            step_env for several envs: advance every env one step, with the
+            greedy actions of all of them from one batched forward pass
+        """
+        store_transitions = (not self.offline_exploitation) or (self.t <= self.num_exploration_steps)
+        if store_transitions:
+            self.replay_buffer_idx = self.replay_buffer.store_frames(
+                self.last_obs)
+
+        perform_random_action = (np.random.random(self.num_envs) < self.eps) | (
+            self.t < self.learning_starts)
+        if perform_random_action.all():
+            actions = np.array([env.action_space.sample() for env in self.envs])
+        else:
+            processed = self.replay_buffer.encode_recent_observations()
+            actions = np.array(self.actor.get_action(processed))
+            for i in np.nonzero(perform_random_action)[0]:
+                actions[i] = self.envs[i].action_space.sample()
+
+        rewards = np.empty(self.num_envs, dtype=np.float32)
+        dones = np.empty(self.num_envs, dtype=bool)
+        for i, env in enumerate(self.envs):
+            next_obs, rewards[i], dones[i], info = env.step(actions[i])
+            if dones[i]:
+                next_obs = env.reset()
+            self.last_obs[i] = next_obs.copy()
+
+        if store_transitions:
+            self.replay_buffer.store_effects(
+                self.replay_buffer_idx, actions, rewards, dones)
@@ -19,7 +19,7 @@ class IQLAgent(DQNAgent):
     def __init__(self, env, agent_params, normalize_rnd=True, rnd_gamma=0.99):
         super(IQLAgent, self).__init__(env, agent_params)
 
-        self.replay_buffer = MemoryOptimizedReplayBuffer(
+        self.replay_buffer = self.make_replay_buffer(
             100000, 1, float_obs=True)
         self.num_exploration_steps = agent_params['num_exploration_steps']
         self.offline_exploitation = agent_params['offline_exploitation']
@@ -128,12 +128,19 @@ class IQLAgent(DQNAgent):
             expl_model_loss = self.exploration_model.update(next_ob_no)
 
             exploration_critic_loss = self.exploration_critic.update(
-                ob_no, ac_na, next_ob_no, mixed_reward, terminal_n)
+                ob_no, ac_na, next_ob_no, mixed_reward, terminal_n,
+                weights=self.sample_weights)
 
             exploitation_critic_loss = self.exploitation_critic.update_v(
                 ob_no, ac_na)
             exploitation_critic_loss.update(self.exploitation_critic.update_q(
-                ob_no, ac_na, next_ob_no, env_reward, terminal_n))
+                ob_no, ac_na, next_ob_no, env_reward, terminal_n,
+                weights=self.sample_weights))
+
+            # Prioritize by the TD errors of the exploitation Q function
+            if self.sample_idxes is not None:
+                self.replay_buffer.update_priorities(
+                    self.sample_idxes, exploitation_critic_loss['TD Errors'])
 
             # TODO: update actor as in AWAC
             # 1): Estimate the advantage
@@ -22,6 +22,8 @@ class CQLCritic(BaseCritic):
 
         self.ac_dim = hparams['ac_dim']
         self.double_q = hparams['double_q']
+        # run the online network on ob_no and next_ob_no in a single pass
+        self.fused_double_q = self.double_q and hparams['fused_double_q']
         self.grad_norm_clipping = hparams['grad_norm_clipping']
         self.gamma = hparams['gamma']
 
@@ -42,7 +44,7 @@ class CQLCritic(BaseCritic):
         self.q_net_target.to(ptu.device)
         self.cql_alpha = hparams['cql_alpha']
 
-    def dqn_loss(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n):
+    def dqn_loss(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n, weights=None, discount_n=None):
         """ Implement DQN Loss """
 
         # Copied from previous homework
@@ -51,18 +53,31 @@ class CQLCritic(BaseCritic):
         if isinstance(ac_na, np.ndarray):
             ac_na = ptu.from_numpy(ac_na).to(torch.long)
         if isinstance(next_ob_no, np.ndarray):
-            next_ob_no = ptu.from_numpy(ob_no)
+            next_ob_no = ptu.from_numpy(next_ob_no)
         if isinstance(reward_n, np.ndarray):
-            reward_n = ptu.from_numpy(ob_no)
+            reward_n = ptu.from_numpy(reward_n)
         if isinstance(terminal_n, np.ndarray):
-            terminal_n = ptu.from_numpy(ob_no)
-
-        qa_t_values = self.q_net(ob_no)
+            terminal_n = ptu.from_numpy(terminal_n)
+        if isinstance(weights, np.ndarray):
+            weights = ptu.from_numpy(weights)
+        if discount_n is None:
+            discount_n = self.gamma
+        elif isinstance(discount_n, np.ndarray):
+            discount_n = ptu.from_numpy(discount_n)
+
+        if self.fused_double_q:
+            # one forward pass over ob_no and next_ob_no together, which also
+            # gives the values double Q-learning picks the next actions with
+            qa_values = self.q_net(torch.cat([ob_no, next_ob_no]))
+            qa_t_values, qa_tp1_online_values = qa_values.split(len(ob_no))
+        else:
+            qa_t_values = self.q_net(ob_no)
         q_t_values = torch.gather(
             qa_t_values, 1, ac_na.unsqueeze(1)).squeeze(1)
 
         # TODO compute the Q-values from the target network
-        qa_tp1_values = self.q_net_target(next_ob_no)
+        with torch.no_grad():
+            qa_tp1_values = self.q_net_target(next_ob_no)
 
         if self.double_q:
             # You must fill this part for Q2 of the Q-learning portion of the homework.
@@ -70,7 +85,10 @@ class CQLCritic(BaseCritic):
             # is being updated, but the Q-value for this action is obtained from the
             # target Q-network. Please review Lecture 8 for more details,
             # and page 4 of https://arxiv.org/pdf/1509.06461.pdf is also a good reference.
-            next_actions = self.q_net(next_ob_no).argmax(dim=1)
+            if self.fused_double_q:
+                next_actions = qa_tp1_online_values.argmax(dim=1)
+            else:
+                next_actions = self.q_net(next_ob_no).argmax(dim=1)
             q_tp1 = torch.gather(
                 qa_tp1_values, 1, next_actions.unsqueeze(1)).squeeze(1)
 
@@ -80,13 +98,17 @@ class CQLCritic(BaseCritic):
         # TODO compute targets for minimizing Bellman error
         # HINT: as you saw in lecture, this would be:
             #currentReward + self.gamma * qValuesOfNextTimestep * (not terminal)
-        target = reward_n + self.gamma * q_tp1 * (1 - terminal_n)
+        target = reward_n + discount_n * q_tp1 * (1 - terminal_n)
         target = target.detach()
-        loss = self.loss(q_t_values, target)
+        if weights is None:
+            loss = self.loss(q_t_values, target)
+        else:
+            loss = (weights * nn.functional.mse_loss(
+                q_t_values, target, reduction='none')).mean()
 
-        return loss, qa_t_values, q_t_values
+        return loss, qa_t_values, q_t_values, target
 
-    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n):
+    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n, weights=None, discount_n=None):
         """
             Update the parameters of the critic.
             let sum_of_path_lengths be the sum of the lengths of the paths sampled from
@@ -99,25 +121,41 @@ class CQLCritic(BaseCritic):
                     the reward for each timestep
                 terminal_n: length: sum_of_path_lengths. Each element in terminal_n is either 1 if the episode ended
                     at that timestep of 0 if the episode did not end
+                weights: optional, length: sum_of_path_lengths. Importance sampling weights of the
+                    transitions (from a PrioritizedReplayBuffer) to scale their losses with
+                discount_n: optional, length: sum_of_path_lengths. Per-transition discount of the
+                    value of next_ob_no (e.g. of n-step transitions), instead of self.gamma
+                all of them can be numpy arrays or tensors already on ptu.device
             returns:
-                nothing
+                a dict of logs, where 'TD Errors' holds the per-transition TD errors
         """
-        ob_no = ptu.from_numpy(ob_no)
-        ac_na = ptu.from_numpy(ac_na).to(torch.long)
-        next_ob_no = ptu.from_numpy(next_ob_no)
-        reward_n = ptu.from_numpy(reward_n)
-        terminal_n = ptu.from_numpy(terminal_n)
+        if isinstance(ob_no, np.ndarray):
+            ob_no = ptu.from_numpy(ob_no)
+        if isinstance(ac_na, np.ndarray):
+            ac_na = ptu.from_numpy(ac_na)
+        ac_na = ac_na.to(torch.long)
+        if isinstance(next_ob_no, np.ndarray):
+            next_ob_no = ptu.from_numpy(next_ob_no)
+        if isinstance(reward_n, np.ndarray):
+            reward_n = ptu.from_numpy(reward_n)
+        if isinstance(terminal_n, np.ndarray):
+            terminal_n = ptu.from_numpy(terminal_n)
+        if isinstance(weights, np.ndarray):
+            weights = ptu.from_numpy(weights)
 
         # Compute the DQN Loss
-        loss, qa_t_values, q_t_values = self.dqn_loss(
-            ob_no, ac_na, next_ob_no, reward_n, terminal_n
+        loss, qa_t_values, q_t_values, target = self.dqn_loss(
+            ob_no, ac_na, next_ob_no, reward_n, terminal_n, weights, discount_n
         )
 
         # CQL Implementation
         # TODO: Implement CQL as described in the pdf and paper
         # Hint: After calculating cql_loss, augment the loss appropriately
         q_t_logsumexp = torch.logsumexp(qa_t_values, dim=1)
-        cql_loss = (q_t_logsumexp-q_t_values).mean()
+        if weights is None:
+            cql_loss = (q_t_logsumexp-q_t_values).mean()
+        else:
+            cql_loss = (weights * (q_t_logsumexp-q_t_values)).mean()
 
         # Add the CQL to loss
         full_loss = self.cql_alpha * cql_loss + loss
@@ -131,6 +169,7 @@ class CQLCritic(BaseCritic):
         self.learning_rate_scheduler.step()
 
         info = {'Training Loss': ptu.to_numpy(loss)}
+        info['TD Errors'] = ptu.to_numpy(target - q_t_values)
 
         # TODO: Uncomment these lines after implementing CQL
         info['CQL Loss'] = ptu.to_numpy(cql_loss)
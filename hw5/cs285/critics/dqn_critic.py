@@ -1,4 +1,5 @@
 from .base_critic import BaseCritic
+import numpy as np
 import torch
 import torch.optim as optim
 from torch.nn import utils
@@ -22,6 +23,8 @@ class DQNCritic(BaseCritic):
 
         self.ac_dim = hparams['ac_dim']
         self.double_q = hparams['double_q']
+        # run the online network on ob_no and next_ob_no in a single pass
+        self.fused_double_q = self.double_q and hparams['fused_double_q']
         self.grad_norm_clipping = hparams['grad_norm_clipping']
         self.gamma = hparams['gamma']
 
@@ -41,7 +44,7 @@ class DQNCritic(BaseCritic):
         self.q_net.to(ptu.device)
         self.q_net_target.to(ptu.device)
 
-    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n):
+    def update(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n, weights=None, discount_n=None):
         """
             Update the parameters of the critic.
             let sum_of_path_lengths be the sum of the lengths of the paths sampled from
@@ -54,28 +57,59 @@ class DQNCritic(BaseCritic):
                     the reward for each timestep
                 terminal_n: length: sum_of_path_lengths. Each element in terminal_n is either 1 if the episode ended
                     at that timestep of 0 if the episode did not end
+                weights: optional, length: sum_of_path_lengths. Importance sampling weights of the
+                    transitions (from a PrioritizedReplayBuffer) to scale their losses with
+                discount_n: optional, length: sum_of_path_lengths. Per-transition discount of the
+                    value of next_ob_no (e.g. of n-step transitions), instead of self.gamma
+                all of them can be numpy arrays or tensors already on ptu.device
             returns:
-                nothing
+                a dict of logs, where 'TD Errors' holds the per-transition TD errors
         """
-        ob_no = ptu.from_numpy(ob_no)
-        ac_na = ptu.from_numpy(ac_na).to(torch.long)
-        next_ob_no = ptu.from_numpy(next_ob_no)
-        reward_n = ptu.from_numpy(reward_n)
-        terminal_n = ptu.from_numpy(terminal_n)
+        if isinstance(ob_no, np.ndarray):
+            ob_no = ptu.from_numpy(ob_no)
+        if isinstance(ac_na, np.ndarray):
+            ac_na = ptu.from_numpy(ac_na)
+        ac_na = ac_na.to(torch.long)
+        if isinstance(next_ob_no, np.ndarray):
+            next_ob_no = ptu.from_numpy(next_ob_no)
+        if isinstance(reward_n, np.ndarray):
+            reward_n = ptu.from_numpy(reward_n)
+        if isinstance(terminal_n, np.ndarray):
+            terminal_n = ptu.from_numpy(terminal_n)
+        if discount_n is None:
+            discount_n = self.gamma
+        elif isinstance(discount_n, np.ndarray):
+            discount_n = ptu.from_numpy(discount_n)
 
-        qa_t_values = self.q_net(ob_no)
+        if self.fused_double_q:
+            # one forward pass over ob_no and next_ob_no together, which also
+            # gives the values double Q-learning picks the next actions with
+            qa_values = self.q_net(torch.cat([ob_no, next_ob_no]))
+            qa_t_values, qa_tp1_online_values = qa_values.split(len(ob_no))
+        else:
+            qa_t_values = self.q_net(ob_no)
         q_t_values = torch.gather(qa_t_values, 1, ac_na.unsqueeze(1)).squeeze(1)
-        qa_tp1_values = self.q_net_target(next_ob_no)
+        with torch.no_grad():
+            qa_tp1_values = self.q_net_target(next_ob_no)
 
         if self.double_q:
-            next_actions = self.q_net(next_ob_no).argmax(dim=1)
+            if self.fused_double_q:
+                next_actions = qa_tp1_online_values.argmax(dim=1)
+            else:
+                next_actions = self.q_net(next_ob_no).argmax(dim=1)
             q_tp1 = torch.gather(qa_tp1_values, 1, next_actions.unsqueeze(1)).squeeze(1)
         else:
             q_tp1, _ = qa_tp1_values.max(dim=1)
 
-        target = reward_n + self.gamma * q_tp1 * (1 - terminal_n)
+        target = reward_n + discount_n * q_tp1 * (1 - terminal_n)
         target = target.detach()
-        loss = self.loss(q_t_values, target)
+        if weights is None:
+            loss = self.loss(q_t_values, target)
+        else:
+            if isinstance(weights, np.ndarray):
+                weights = ptu.from_numpy(weights)
+            loss = (weights * nn.functional.smooth_l1_loss(
+                q_t_values, target, reduction='none')).mean()
     
         self.optimizer.zero_grad()
         loss.backward()
@@ -84,7 +118,10 @@ class DQNCritic(BaseCritic):
         
         self.learning_rate_scheduler.step()
 
-        return {'Training Loss': ptu.to_numpy(loss)}
+        return {
+            'Training Loss': ptu.to_numpy(loss),
+            'TD Errors': ptu.to_numpy(target - q_t_values),
+        }
 
     ####################################
     ####################################
@@ -71,8 +71,11 @@ class IQLCritic(BaseCritic):
         """
         Update value function using expectile loss
         """
-        ob_no = ptu.from_numpy(ob_no)
-        ac_na = ptu.from_numpy(ac_na).to(torch.long)
+        if isinstance(ob_no, np.ndarray):
+            ob_no = ptu.from_numpy(ob_no)
+        if isinstance(ac_na, np.ndarray):
+            ac_na = ptu.from_numpy(ac_na)
+        ac_na = ac_na.to(torch.long)
 
         ### YOUR CODE HERE ###
         v = self.v_net(ob_no)
@@ -90,15 +93,22 @@ class IQLCritic(BaseCritic):
 
         return {'Training V Loss': ptu.to_numpy(value_loss)}
 
-    def update_q(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n):
+    def update_q(self, ob_no, ac_na, next_ob_no, reward_n, terminal_n, weights=None):
         """
-        Use target v network to train Q
+        Use target v network to train Q, with the losses scaled by the
+        importance sampling `weights` if given; also returns the TD errors
         """
-        ob_no = ptu.from_numpy(ob_no)
-        ac_na = ptu.from_numpy(ac_na).to(torch.long)
-        next_ob_no = ptu.from_numpy(next_ob_no)
-        reward_n = ptu.from_numpy(reward_n)
-        terminal_n = ptu.from_numpy(terminal_n)
+        if isinstance(ob_no, np.ndarray):
+            ob_no = ptu.from_numpy(ob_no)
+        if isinstance(ac_na, np.ndarray):
+            ac_na = ptu.from_numpy(ac_na)
+        ac_na = ac_na.to(torch.long)
+        if isinstance(next_ob_no, np.ndarray):
+            next_ob_no = ptu.from_numpy(next_ob_no)
+        if isinstance(reward_n, np.ndarray):
+            reward_n = ptu.from_numpy(reward_n)
+        if isinstance(terminal_n, np.ndarray):
+            terminal_n = ptu.from_numpy(terminal_n)
 
         ### YOUR CODE HERE ###
         q_vals = torch.gather(self.q_net(ob_no), 1,
@@ -106,7 +116,13 @@ class IQLCritic(BaseCritic):
         v_vals = self.v_net(next_ob_no).squeeze(1).detach()
 
         targets = reward_n + self.gamma * v_vals * (1 - terminal_n)
-        loss = self.mse_loss(q_vals, targets)
+        if weights is None:
+            loss = self.mse_loss(q_vals, targets)
+        else:
+            if isinstance(weights, np.ndarray):
+                weights = ptu.from_numpy(weights)
+            loss = (weights * nn.functional.mse_loss(
+                q_vals, targets, reduction='none')).mean()
         assert loss.shape == ()
         self.optimizer.zero_grad()
         loss.backward()
@@ -116,7 +132,10 @@ class IQLCritic(BaseCritic):
 
         self.learning_rate_scheduler.step()
 
-        return {'Training Q Loss': ptu.to_numpy(loss)}
+        return {
+            'Training Q Loss': ptu.to_numpy(loss),
+            'TD Errors': ptu.to_numpy(targets - q_vals),
+        }
 
     def update_target_network(self):
         for target_param, param in zip(
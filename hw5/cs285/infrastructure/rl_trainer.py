@@ -29,6 +29,11 @@ MAX_NVIDEO = 2
 MAX_VIDEO_LEN = 40 # we overwrite this in the code below
 
 
+def _includes_multiple(start, num_steps, freq):
+    # whether one of the num_steps steps from step start is a multiple of freq
+    return (start + num_steps - 1) // freq != (start - 1) // freq
+
+
 class RL_Trainer(object):
 
     def __init__(self, params):
@@ -92,6 +97,18 @@ class RL_Trainer(object):
         self.env.seed(seed)
         self.eval_env.seed(seed)
 
+        # more copies of the env, for an agent that steps several at once
+        self.envs = [self.env]
+        for i in range(1, self.params.get('num_envs', 1)):
+            env = gym.make(self.params['env_name'])
+            if not ('pointmass' in self.params['env_name']):
+                env.set_logdir(self.params['logdir'] + '/expl{}_'.format(i))
+            env = wrappers.RecordEpisodeStatistics(env, deque_size=1000)
+            env = ReturnWrapper(env)
+            env = params['env_wrappers'](env)
+            env.seed(seed + i)
+            self.envs.append(env)
+
         # Maximum length for episodes
         self.params['ep_len'] = self.params['ep_len'] or self.env.spec.max_episode_steps
         global MAX_VIDEO_LEN
@@ -127,7 +144,10 @@ class RL_Trainer(object):
         #############
 
         agent_class = self.params['agent_class']
-        self.agent = agent_class(self.env, self.params['agent_params'])
+        if len(self.envs) > 1:
+            self.agent = agent_class(self.envs, self.params['agent_params'])
+        else:
+            self.agent = agent_class(self.env, self.params['agent_params'])
 
     def run_training_loop(self, n_iter, collect_policy, eval_policy,
                           buffer_name=None,
@@ -149,12 +169,17 @@ class RL_Trainer(object):
 
         print_period = 1000 if isinstance(self.agent, ExplorationOrExploitationAgent) else 1
 
-        for itr in range(n_iter):
+        # an exploration agent takes one iteration per step of each of its
+        # envs, so n_iter and the logging frequencies count env steps
+        num_envs = len(self.envs)
+
+        for itr in range(n_iter // num_envs):
             if itr % print_period == 0:
                 print("\n\n********** Iteration %i ************"%itr)
 
             # decide if videos should be rendered/logged at this iteration
-            if itr % self.params['video_log_freq'] == 0 and self.params['video_log_freq'] != -1:
+            if (self.params['video_log_freq'] != -1 and _includes_multiple(
+                    itr * num_envs, num_envs, self.params['video_log_freq'])):
                 self.logvideo = True
             else:
                 self.logvideo = False
@@ -162,7 +187,7 @@ class RL_Trainer(object):
             # decide if metrics should be logged
             if self.params['scalar_log_freq'] == -1:
                 self.logmetrics = False
-            elif itr % self.params['scalar_log_freq'] == 0:
+            elif _includes_multiple(itr * num_envs, num_envs, self.params['scalar_log_freq']):
                 self.logmetrics = True
             else:
                 self.logmetrics = False
@@ -170,7 +195,7 @@ class RL_Trainer(object):
             # collect trajectories, to be used for training
             if isinstance(self.agent, ExplorationOrExploitationAgent):
                 self.agent.step_env()
-                envsteps_this_batch = 1
+                envsteps_this_batch = num_envs
                 train_video_paths = None
                 paths = None
             else:
@@ -210,12 +235,17 @@ class RL_Trainer(object):
                 print('\nBeginning logging procedure...')
                 if isinstance(self.agent, ExplorationOrExploitationAgent):
                     self.perform_dqn_logging(all_logs)
+                    # checkpoint an on-disk replay buffer along with the logs
+                    self.agent.replay_buffer.flush()
                 else:
                     self.perform_logging(itr, paths, eval_policy, train_video_paths, all_logs)
 
                 if self.params['save_params']:
                     self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
 
+        if isinstance(self.agent, ExplorationOrExploitationAgent):
+            self.agent.replay_buffer.flush()
+
     ####################################
     ####################################
 
@@ -255,7 +285,9 @@ class RL_Trainer(object):
 
     def train_agent(self):
         all_logs = []
-        for train_step in range(self.params['num_agent_train_steps_per_iter']):
+        # an agent stepping several envs at once trains as often per env step
+        # as one with a single env
+        for train_step in range(self.params['num_agent_train_steps_per_iter'] * len(self.envs)):
             ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch = self.agent.sample(self.params['train_batch_size'])
             train_log = self.agent.train(ob_batch, ac_batch, re_batch, next_ob_batch, terminal_batch)
             all_logs.append(train_log)
@@ -274,10 +306,14 @@ class RL_Trainer(object):
     def perform_dqn_logging(self, all_logs):
         last_log = all_logs[-1]
 
-        episode_rewards = self.env.get_episode_rewards()
-        if len(episode_rewards) > 0:
-            self.mean_episode_reward = np.mean(episode_rewards[-100:])
-        if len(episode_rewards) > 100:
+        episode_rewards = [env.get_episode_rewards() for env in self.envs]
+        num_episodes = sum(len(rewards) for rewards in episode_rewards)
+        # the last 100 episodes, as many from each env
+        num_recent = -(-100 // len(self.envs))
+        recent_rewards = np.concatenate([rewards[-num_recent:] for rewards in episode_rewards])
+        if num_episodes > 0:
+            self.mean_episode_reward = np.mean(recent_rewards)
+        if num_episodes > 100:
             self.best_mean_episode_reward = max(self.best_mean_episode_reward, self.mean_episode_reward)
 
         logs = OrderedDict()
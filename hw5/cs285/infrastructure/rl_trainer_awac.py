@@ -210,12 +210,17 @@ class RL_Trainer(object):
                 print('\nBeginning logging procedure...')
                 if isinstance(self.agent, AWACAgent) or isinstance(self.agent, IQLAgent):
                     self.perform_dqn_logging(all_logs)
+                    # checkpoint an on-disk replay buffer along with the logs
+                    self.agent.replay_buffer.flush()
                 else:
                     self.perform_logging(itr, paths, eval_policy, train_video_paths, all_logs)
 
                 if self.params['save_params']:
                     self.agent.save('{}/agent_itr_{}.pt'.format(self.params['logdir'], itr))
 
+        if isinstance(self.agent, AWACAgent) or isinstance(self.agent, IQLAgent):
+            self.agent.replay_buffer.flush()
+
     ####################################
     ####################################
 
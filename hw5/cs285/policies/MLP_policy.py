@@ -115,13 +115,11 @@ class MLPPolicy(BasePolicy, nn.Module, metaclass=abc.ABCMeta):
             return action_distribution
         else:
             batch_mean = self.mean_net(observation)
-            scale_tril = torch.diag(torch.exp(self.logstd))
-            batch_dim = batch_mean.shape[0]
-            batch_scale_tril = scale_tril.repeat(batch_dim, 1, 1)
-            action_distribution = distributions.MultivariateNormal(
-                batch_mean,
-                scale_tril=batch_scale_tril,
-            )
+            # a diagonal Gaussian: independent Normals over the action
+            # dimensions, so log_prob and sample are elementwise, without
+            # building (and solving with) a covariance matrix per sample
+            action_distribution = distributions.Independent(
+                distributions.Normal(batch_mean, torch.exp(self.logstd)), 1)
             return action_distribution
 
     ####################################
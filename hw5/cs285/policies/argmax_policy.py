@@ -12,8 +12,10 @@ class ArgMaxPolicy(object):
         self.critic = critic
 
     def get_action(self, obs):
-        # MJ: changed the dimension check to a 3
-        if len(obs.shape) > 3:
+        # a batch of observations (e.g. one from each of several envs), or a
+        # single one
+        batched = len(obs.shape) > len(self.critic.input_shape)
+        if batched:
             observation = obs
         else:
             observation = obs[None]
@@ -23,11 +25,13 @@ class ArgMaxPolicy(object):
         q_values = self.critic.qa_values(observation)
 
         if self.use_boltzmann:
-            distribution = np.exp(q_values) / np.sum(np.exp(q_values))
+            distribution = np.exp(q_values) / np.sum(np.exp(q_values), axis=-1, keepdims=True)
             action = self.sample_discrete(distribution)
         else:
             action = q_values.argmax(-1)
 
+        if batched:
+            return action
         return action[0]
 
     def sample_discrete(self, p):
@@ -58,6 +58,7 @@ def main():
 
     parser.add_argument('--offline_exploitation', action='store_true')
     parser.add_argument('--cql_alpha', type=float, default=0.0)
+    parser.add_argument('--fused_double_q', action='store_true') #with double_q, one q_net forward pass over the observations and next observations together
 
     parser.add_argument('--exploit_rew_shift', type=float, default=0.0)
     parser.add_argument('--exploit_rew_scale', type=float, default=1.0)
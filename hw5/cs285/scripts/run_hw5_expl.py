@@ -59,6 +59,14 @@ def main():
     parser.add_argument('--offline_exploitation', action='store_true')
     parser.add_argument('--cql_alpha', type=float, default=0.0)
 
+    parser.add_argument('--prioritized_replay', action='store_true')
+    parser.add_argument('--prioritized_replay_alpha', type=float, default=0.6)
+    parser.add_argument('--prioritized_replay_beta', type=float, default=0.4)
+    parser.add_argument('--memmap_replay', action='store_true')
+    parser.add_argument('--fused_double_q', action='store_true') #with double_q, one q_net forward pass over the observations and next observations together
+    parser.add_argument('--n_step', type=int, default=1)
+    parser.add_argument('--num_envs', type=int, default=1) #step this many envs at once, with batched action selection
+
     parser.add_argument('--exploit_rew_shift', type=float, default=0.0)
     parser.add_argument('--exploit_rew_scale', type=float, default=1.0)
 
@@ -58,6 +58,12 @@ def main():
 
     parser.add_argument('--offline_exploitation', action='store_true')
     parser.add_argument('--cql_alpha', type=float, default=0.0)
+
+    parser.add_argument('--prioritized_replay', action='store_true')
+    parser.add_argument('--prioritized_replay_alpha', type=float, default=0.6)
+    parser.add_argument('--prioritized_replay_beta', type=float, default=0.4)
+    parser.add_argument('--memmap_replay', action='store_true')
+    parser.add_argument('--fused_double_q', action='store_true') #with double_q, one q_net forward pass over the observations and next observations together
     parser.add_argument('--iql_expectile', type=float, default=0.8)
 
     parser.add_argument('--exploit_rew_shift', type=float, default=0.0)